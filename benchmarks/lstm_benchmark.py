@@ -0,0 +1,143 @@
+# coding=utf-8
+# Copyright 2021 The Google Research Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Lint as: python3
+"""Benchmarks the CPU LSTM used by the TFT when use_cudnn is off.
+
+Weights of a CuDNNLSTM, as created by a use_cudnn=True graph, are saved to a
+checkpoint and restored into a CuDNNCompatibleLSTM, which is then timed against
+a Keras LSTM of the same size -- the only other LSTM that runs on CPU.
+
+Usage:
+  python3 -m benchmarks.lstm_benchmark {UNITS} ...
+
+Command line args:
+  UNITS: Hidden sizes to benchmark, with inputs of the same size.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import libs.tft_model
+import numpy as np
+import tensorflow.compat.v1 as tf
+
+CuDNNCompatibleLSTM = libs.tft_model.CuDNNCompatibleLSTM
+
+
+def save_cudnn_checkpoint(units, input_size, checkpoint_path):
+  """Saves randomly initialised CuDNNLSTM weights to a checkpoint."""
+
+  with tf.Graph().as_default(), tf.Session() as sess:
+    # The CuDNN op has no CPU kernel, so only the weights are created, under
+    # the same names as when the layer is called
+    lstm = tf.keras.layers.CuDNNLSTM(units, return_sequences=True, name='lstm')
+    with tf.name_scope(lstm.name):
+      lstm.build((None, None, input_size))
+    sess.run(tf.global_variables_initializer())
+    tf.train.Saver(lstm.weights).save(sess, checkpoint_path)
+
+
+def time_layer(layer, inputs, repeats, checkpoint_path=None):
+  """Returns sequences per second for forward and forward + backward passes.
+
+  Args:
+    layer: Keras LSTM layer to benchmark
+    inputs: Array of inputs with shape=(batch_size, time_steps, input_size)
+    repeats: Number of timed runs, after a single warm-up run
+    checkpoint_path: Optional checkpoint to restore layer weights from
+
+  Returns:
+    Tuple of (forward, forward + backward) sequences per second.
+  """
+
+  with tf.Graph().as_default(), tf.Session() as sess:
+    placeholder = tf.placeholder(tf.float32, (None,) + inputs.shape[1:])
+    outputs = layer(placeholder)
+    gradients = tf.gradients(tf.reduce_sum(outputs), layer.trainable_weights)
+
+    sess.run(tf.global_variables_initializer())
+    if checkpoint_path is not None:
+      tf.train.Saver(layer.weights).restore(sess, checkpoint_path)
+
+    results = []
+    for fetches in [outputs, gradients]:
+      sess.run(fetches, {placeholder: inputs})
+      start = time.time()
+      for _ in range(repeats):
+        sess.run(fetches, {placeholder: inputs})
+      results.append(repeats * len(inputs) / (time.time() - start))
+
+  return tuple(results)
+
+
+def main(units_list, batch_size, time_steps, repeats):
+  """Runs LSTM benchmark for each hidden size.
+
+  Args:
+    units_list: Hidden sizes to benchmark
+    batch_size: Number of sequences per batch
+    time_steps: Number of time steps per sequence
+    repeats: Number of timed runs per measurement
+  """
+
+  print('Sequences per second, batch_size={} time_steps={}'.format(
+      batch_size, time_steps))
+  print('{:>6}  {:>22}  {:>22}'.format('units', 'fwd (keras / fused)',
+                                       'fwd+bwd (keras / fused)'))
+
+  checkpoint_folder = tempfile.mkdtemp()
+  for units in units_list:
+    inputs = np.random.rand(batch_size, time_steps, units).astype(np.float32)
+    checkpoint_path = os.path.join(checkpoint_folder, 'lstm_{}'.format(units))
+    save_cudnn_checkpoint(units, units, checkpoint_path)
+
+    keras = time_layer(
+        tf.keras.layers.LSTM(units, return_sequences=True), inputs, repeats)
+    fused = time_layer(
+        CuDNNCompatibleLSTM(units, return_sequences=True, name='lstm'), inputs,
+        repeats, checkpoint_path)
+
+    print('{:>6}  {:>10.0f} / {:<9.0f}  {:>10.0f} / {:<9.0f}'.format(
+        units, keras[0], fused[0], keras[1], fused[1]))
+
+
+if __name__ == '__main__':
+
+  def get_args():
+    """Returns settings from command line."""
+
+    parser = argparse.ArgumentParser(description='LSTM benchmark configs')
+    parser.add_argument(
+        'units',
+        metavar='u',
+        type=int,
+        nargs='*',
+        default=[16, 64, 160],
+        help='Hidden sizes to benchmark. Default=16 64 160')
+    parser.add_argument(
+        '--batch_size', type=int, default=256, help='Sequences per batch')
+    parser.add_argument(
+        '--time_steps', type=int, default=192, help='Time steps per sequence')
+    parser.add_argument(
+        '--repeats', type=int, default=3, help='Timed runs per measurement')
+
+    args = parser.parse_known_args()[0]
+
+    return args.units, args.batch_size, args.time_steps, args.repeats
+
+  main(*get_args())
@@ -56,8 +56,23 @@ class GenericDataFormatter(abc.ABC):
   User can implement the abstract methods below to perform dataset-specific
   manipulations.
 
+  Attributes:
+    split_columns: Names of any columns outside the column definition which are
+      required to split data.
+    prediction_index_columns: Names of columns in prediction dataframes which
+      index forecasts, rather than hold forecast values.
   """
 
+  split_columns = []
+  prediction_index_columns = {'forecast_time', 'identifier', 'horizon', 'target'}
+
+  def get_prediction_value_columns(self, predictions):
+    """Returns names of columns holding forecast values in predictions."""
+    return [
+        col for col in predictions.columns
+        if col not in self.prediction_index_columns
+    ]
+
   @abc.abstractmethod
   def set_scalers(self, df):
     """Calibrates scalers using the data supplied."""
@@ -95,6 +110,15 @@ class GenericDataFormatter(abc.ABC):
       'early_stopping_patience': Early stopping param for keras
       'multiprocessing_workers': # of cpus for data processing
 
+    Optionally accepts:
+      'attention_chunk_size': Number of keys per block for memory-efficient
+        decoder self-attention, or 0 to attend over all keys at once
+      'horizon_only_attention': Whether to compute decoder self-attention
+        queries for forecast horizon positions only
+      'precision_policy': Keras precision policy to build the model with --
+        'float32' (default), 'mixed_float16' or 'mixed_bfloat16'
+      'quantiles': List of quantiles to forecast, [0.1, 0.5, 0.9] by default
+
 
     Returns:
       A dictionary of fixed parameters, e.g.:
@@ -160,6 +184,12 @@ class GenericDataFormatter(abc.ABC):
 
     return identifier + time + real_inputs + categorical_inputs
 
+  def get_data_columns(self):
+    """Returns names of all columns that need to be read from the data file."""
+    columns = [tup[0] for tup in self._column_definition] + self.split_columns
+
+    return list(dict.fromkeys(columns))  # removes duplicates, preserving order
+
   def _get_input_columns(self):
     """Returns names of all input columns."""
     return [
@@ -22,6 +22,7 @@ entity specific z-score normalization.
 
 import data_formatters.base
 import libs.utils as utils
+import numpy as np
 import pandas as pd
 import sklearn.preprocessing
 
@@ -52,6 +53,8 @@ class ElectricityFormatter(GenericDataFormatter):
       ('categorical_id', DataTypes.CATEGORICAL, InputTypes.STATIC_INPUT),
   ]
 
+  split_columns = ['days_from_start']
+
   def __init__(self):
     """Initialises formatter."""
 
@@ -194,6 +197,9 @@ class ElectricityFormatter(GenericDataFormatter):
   def format_predictions(self, predictions):
     """Reverts any normalisation to give predictions in original scale.
 
+    Per-entity target statistics are broadcast over all forecast columns at
+    once, indexed by the code of each identifier.
+
     Args:
       predictions: Dataframe of model predictions.
 
@@ -204,19 +210,19 @@ class ElectricityFormatter(GenericDataFormatter):
     if self._target_scaler is None:
       raise ValueError('Scalers have not been set!')
 
-    column_names = predictions.columns
+    identifiers = pd.Index(list(self._target_scaler))
+    codes = identifiers.get_indexer(predictions['identifier'])
+    if np.any(codes < 0):
+      raise KeyError('No target scaler for identifiers: {}'.format(
+          list(predictions['identifier'][codes < 0].unique())))
 
-    df_list = []
-    for identifier, sliced in predictions.groupby('identifier'):
-      sliced_copy = sliced.copy()
-      target_scaler = self._target_scaler[identifier]
+    means = np.array([self._target_scaler[i].mean_[0] for i in identifiers])
+    scales = np.array([self._target_scaler[i].scale_[0] for i in identifiers])
 
-      for col in column_names:
-        if col not in {'forecast_time', 'identifier'}:
-          sliced_copy[col] = target_scaler.inverse_transform(sliced_copy[col])
-      df_list.append(sliced_copy)
-
-    output = pd.concat(df_list, axis=0)
+    value_columns = self.get_prediction_value_columns(predictions)
+    output = predictions.copy()
+    output[value_columns] = predictions[value_columns].values \
+        * scales[codes, np.newaxis] + means[codes, np.newaxis]
 
     return output
 
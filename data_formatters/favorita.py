@@ -233,13 +233,11 @@ class FavoritaFormatter(data_formatters.base.GenericDataFormatter):
     Returns:
       Data frame of unnormalised predictions.
     """
+    value_columns = self.get_prediction_value_columns(predictions)
     output = predictions.copy()
 
-    column_names = predictions.columns
     mean, std = self._target_scaler
-    for col in column_names:
-      if col not in {'forecast_time', 'identifier'}:
-        output[col] = (predictions[col] * std) + mean
+    output[value_columns] = (predictions[value_columns].values * std) + mean
 
     return output
 
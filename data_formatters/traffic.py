@@ -51,6 +51,8 @@ class TrafficFormatter(VolatilityFormatter):
       ('categorical_id', DataTypes.CATEGORICAL, InputTypes.STATIC_INPUT),
   ]
 
+  split_columns = ['sensor_day']
+
   def split_data(self, df, valid_boundary=151, test_boundary=166):
     """Splits data frame into training-validation-test data frames.
 
@@ -50,6 +50,8 @@ class VolatilityFormatter(GenericDataFormatter):
       ('Region', DataTypes.CATEGORICAL, InputTypes.STATIC_INPUT),
   ]
 
+  split_columns = ['year']
+
   def __init__(self):
     """Initialises formatter."""
 
@@ -174,13 +176,10 @@ class VolatilityFormatter(GenericDataFormatter):
     Returns:
       Data frame of unnormalised predictions.
     """
+    value_columns = self.get_prediction_value_columns(predictions)
     output = predictions.copy()
-
-    column_names = predictions.columns
-
-    for col in column_names:
-      if col not in {'forecast_time', 'identifier'}:
-        output[col] = self._target_scaler.inverse_transform(predictions[col])
+    output[value_columns] = predictions[value_columns].values \
+        * self._target_scaler.scale_[0] + self._target_scaler.mean_[0]
 
     return output
 
@@ -20,7 +20,9 @@ Contains the default output paths for data, serialised models and predictions
 for the main experiments used in the publication.
 """
 
+import json
 import os
+import shutil
 
 import data_formatters.electricity
 import data_formatters.favorita
@@ -28,6 +30,7 @@ import data_formatters.traffic
 import data_formatters.volatility
 import data_formatters.dacon
 # import data_formatters.ulsan
+import pandas as pd
 
 
 class ExperimentConfig(object):
@@ -39,19 +42,26 @@ class ExperimentConfig(object):
     data_folder: Folder to store data for experiment.
     model_folder: Folder to store serialised models.
     results_folder: Folder to store results.
-    data_csv_path: Path to primary data csv file used in experiment.
+    cache_folder: Folder to store batched data cached across runs.
+    data_format: File format of primary data file, either 'csv' or 'parquet'.
+    data_csv_path: Path to primary data file used in experiment.
     hyperparam_iterations: Default number of random search iterations for
       experiment.
   """
 
   default_experiments = ['volatility', 'electricity', 'traffic', 'favorita', 'dacon', 'ulsan']
 
-  def __init__(self, experiment='volatility', root_folder=None):
+  data_formats = ['csv', 'parquet']
+
+  def __init__(self, experiment='volatility', root_folder=None,
+               data_format=None):
     """Creates configs based on default experiment chosen.
 
     Args:
       experiment: Name of experiment.
       root_folder: Root folder to save all outputs of training.
+      data_format: File format of primary data file. Defaults to parquet if a
+        parquet file is already present, and csv otherwise.
     """
 
     if experiment not in self.default_experiments:
@@ -68,17 +78,29 @@ class ExperimentConfig(object):
     self.data_folder = os.path.join(root_folder, 'data', experiment)
     self.model_folder = os.path.join(root_folder, 'saved_models', experiment)
     self.results_folder = os.path.join(root_folder, 'results', experiment)
+    self.cache_folder = os.path.join(root_folder, 'cache', experiment)
 
     # Creates folders if they don't exist
     for relevant_directory in [
         self.root_folder, self.data_folder, self.model_folder,
-        self.results_folder
+        self.results_folder, self.cache_folder
     ]:
       if not os.path.exists(relevant_directory):
         os.makedirs(relevant_directory)
 
+    if data_format is None:
+      parquet_path = self._get_data_path('parquet')
+      data_format = 'parquet' if os.path.exists(parquet_path) else 'csv'
+    if data_format not in self.data_formats:
+      raise ValueError('Unrecognised data format={}'.format(data_format))
+    self.data_format = data_format
+
   @property
   def data_csv_path(self):
+    return self._get_data_path(self.data_format)
+
+  def _get_data_path(self, data_format):
+    """Returns path to primary data file for a given file format."""
     csv_map = {
         'volatility': 'formatted_omi_vol.csv',
         'electricity': 'hourly_electricity.csv',
@@ -88,7 +110,11 @@ class ExperimentConfig(object):
         'ulsan': 'ulsan_data.csv'
     }
 
-    return os.path.join(self.data_folder, csv_map[self.experiment])
+    filename = csv_map[self.experiment]
+    if data_format != 'csv':
+      filename = os.path.splitext(filename)[0] + '.' + data_format
+
+    return os.path.join(self.data_folder, filename)
 
   @property
   def hyperparam_iterations(self):
@@ -112,3 +138,173 @@ class ExperimentConfig(object):
     }
 
     return data_formatter_class[self.experiment]()
+
+
+# Data file functions.
+def _to_categorical(df):
+  """Returns dataframe with string columns converted to categoricals."""
+  string_cols = [
+      col for col in df.columns
+      if pd.api.types.is_string_dtype(df[col]) and
+      not isinstance(df[col].dtype, pd.CategoricalDtype)
+  ]
+  return df.astype({col: 'category' for col in string_cols})
+
+
+def save_data(df, data_path):
+  """Saves experiment data, using the file format given by its extension.
+
+  String columns are stored as categoricals in columnar formats.
+
+  Args:
+    df: Dataframe to save
+    data_path: Path to output file
+  """
+  if data_path.endswith('.parquet'):
+    _to_categorical(df).to_parquet(data_path)
+  else:
+    df.to_csv(data_path)
+
+
+def get_state_path(data_path):
+  """Returns path to the state file kept next to a data file."""
+  return data_path + '.state.json'
+
+
+def load_data_state(data_path):
+  """Returns state saved by DataFileWriter for a data file, or None."""
+  state_path = get_state_path(data_path)
+  if not os.path.exists(state_path):
+    return None
+  with open(state_path) as f:
+    return json.load(f)
+
+
+class DataFileWriter(object):
+  """Appends experiment data to a file chunk by chunk.
+
+  Loads as the same data as save_data on the concatenated chunks, so that only
+  a single chunk is held in memory. Parquet data is written as a partitioned
+  dataset -- a folder with one part file per writer, holding a row group per
+  chunk.
+
+  The number of rows written, together with any extra entries of state, is
+  saved to a small state file next to the output on close. Appending resumes
+  from this state, so existing data is never read or rewritten.
+
+  Attributes:
+    data_path: Path to output file
+    num_rows: Number of rows written so far
+    state: Dictionary of extra entries saved to the state file on close
+  """
+
+  def __init__(self, data_path, append=False):
+    """Opens writer for the output file.
+
+    Args:
+      data_path: Path to output file
+      append: Whether to add chunks to an existing file, rather than
+        overwriting it
+    """
+    self.data_path = data_path
+    self.num_rows = 0
+    self.state = {}
+    self._parquet_writer = None
+    self._parquet_schema = None
+
+    if not os.path.exists(data_path):
+      append = False
+
+    if append:
+      state = load_data_state(data_path)
+      if state is None:
+        raise ValueError('No state file found for {}, cannot append'.format(
+            data_path))
+      self.num_rows = state.pop('num_rows')
+      self.state = state
+    else:
+      for path in [data_path, get_state_path(data_path)]:
+        if os.path.isdir(path):
+          shutil.rmtree(path)
+        elif os.path.exists(path):
+          os.remove(path)
+
+    if data_path.endswith('.parquet'):
+      self._open_parquet_dataset()
+
+  def _open_parquet_dataset(self):
+    """Creates the dataset folder and the next part file name."""
+    import pyarrow.parquet as pq  # pylint: disable=g-import-not-at-top
+
+    # Parquet files cannot be reopened for writing, so appended chunks go to
+    # a new part file. Names are zero-padded to keep parts in order, and parts
+    # are only renamed to .parquet once complete.
+    if not os.path.exists(self.data_path):
+      os.makedirs(self.data_path)
+    parts = sorted(
+        f for f in os.listdir(self.data_path) if f.endswith('.parquet'))
+    if parts:
+      # Keeps dictionary index widths consistent across parts
+      self._parquet_schema = pq.read_schema(
+          os.path.join(self.data_path, parts[0]))
+    self._part_path = os.path.join(self.data_path,
+                                   'part-{:05d}.parquet'.format(len(parts)))
+
+  def write(self, df):
+    """Appends a chunk of data to the output file."""
+
+    # Index continues across chunks, as if all chunks were concatenated
+    df = df.set_index(pd.RangeIndex(self.num_rows, self.num_rows + len(df)))
+
+    if self.data_path.endswith('.parquet'):
+      import pyarrow as pa  # pylint: disable=g-import-not-at-top
+      import pyarrow.parquet as pq  # pylint: disable=g-import-not-at-top
+
+      table = pa.Table.from_pandas(_to_categorical(df), preserve_index=False)
+      if self._parquet_schema is None:
+        self._parquet_schema = table.schema
+      elif not table.schema.equals(self._parquet_schema):
+        table = table.cast(self._parquet_schema)
+      if self._parquet_writer is None:
+        self._parquet_writer = pq.ParquetWriter(self._part_path + '.tmp',
+                                                self._parquet_schema)
+      self._parquet_writer.write_table(table)
+    else:
+      df.to_csv(self.data_path, mode='a', header=self.num_rows == 0)
+
+    self.num_rows += len(df)
+
+  def close(self):
+    """Finalises the output file and saves its state."""
+    if self._parquet_writer is not None:
+      self._parquet_writer.close()
+      self._parquet_writer = None
+      os.replace(self._part_path + '.tmp', self._part_path)
+
+    # Writes to a temporary file first so a partial state is never read
+    state_path = get_state_path(self.data_path)
+    state = dict(self.state, num_rows=self.num_rows)
+    with open(state_path + '.tmp', 'w') as f:
+      json.dump(state, f, sort_keys=True)
+    os.replace(state_path + '.tmp', state_path)
+
+
+def load_data(data_path, columns=None):
+  """Loads experiment data, reading only the columns required.
+
+  Args:
+    data_path: Path to data file saved by save_data or DataFileWriter
+    columns: Names of columns to load, or None to load all columns
+
+  Returns:
+    Dataframe of experiment data.
+  """
+  if data_path.endswith('.parquet'):
+    return pd.read_parquet(data_path, columns=columns)
+
+  usecols = None
+  if columns is not None:
+    index_col = pd.read_csv(data_path, nrows=0).columns[0]
+    usecols = [index_col] + list(columns)
+
+  return pd.read_csv(data_path, index_col=0, usecols=usecols)
@@ -0,0 +1,74 @@
+# coding=utf-8
+# Copyright 2021 The Google Research Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Lint as: python3
+"""Preprocessing helpers shared by data scripts.
+
+Only depends on numpy and pandas, so that scripts which fork worker processes
+do not need to load TensorFlow.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def parse_24h_time(times, date_format='%Y-%m-%d'):
+  """Parses 'date H:MM:SS' timestamps whose hours run from 1 to 24.
+
+  24:00:00 is midnight of the next day. The clock is added to the date as an
+  offset, so it needs no special case, and each distinct date is only parsed
+  once.
+
+  Args:
+    times: Array of timestamp strings
+    date_format: Format of the date part of each timestamp
+
+  Returns:
+    datetime64 array of parsed timestamps.
+  """
+  values = np.asarray(times, dtype=bytes)
+  if len(values) == 0:
+    return np.array([], dtype='datetime64[ns]')
+
+  chars = values.view(np.uint8).reshape(len(values), -1)
+  rows = np.arange(len(values))
+  digits = chars.astype(np.int64) - ord('0')
+
+  # Reads the 'H:MM:SS' clock after the space from the end of each string
+  end = (chars != 0).sum(axis=1)
+  space = (chars == ord(' ')).argmax(axis=1)
+  seconds = digits[rows, end - 2] * 10 + digits[rows, end - 1]
+  minutes = digits[rows, end - 5] * 10 + digits[rows, end - 4]
+  hours = digits[rows, end - 7] + np.where(end - 8 > space,
+                                           digits[rows, end - 8] * 10, 0)
+  offset = (hours * 3600 + minutes * 60 + seconds).astype('timedelta64[s]')
+
+  date_chars = np.where(np.arange(chars.shape[1]) < space[:, None], chars, 0)
+  dates, inverse = np.unique(date_chars.view(values.dtype).ravel(),
+                             return_inverse=True)
+  dates = pd.to_datetime(dates.astype(str), format=date_format).values
+
+  return dates[inverse] + offset
+
+
+def energy_process(df):
+  """Returns energy data with its 1 to 24 hour timestamps parsed.
+
+  Args:
+    df: Energy dataframe with a 'time' column of 'date H:MM:SS' strings
+  """
+  output = df.copy()
+  output['time'] = parse_24h_time(output['time'])
+  return output
@@ -24,8 +24,12 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import gc
+import collections
+import functools
+import hashlib
 import json
+import mmap
+import multiprocessing
 import os
 import shutil
 
@@ -49,6 +53,7 @@ Lambda = tf.keras.layers.Lambda
 
 # Default input types.
 InputTypes = data_formatters.base.InputTypes
+DataTypes = data_formatters.base.DataTypes
 
 
 # Layer utility functions.
@@ -225,56 +230,293 @@ def gated_residual_network(x,
     return add_and_norm([skip, gating_layer])
 
 
+class ColumnwiseLinear(tf.keras.layers.Layer):
+  """Applies a separate linear transformation to each scalar input column.
+
+  Equivalent to one Dense layer per column, computed for all columns with a
+  single broadcast multiply-add.
+
+  Attributes:
+    size: Output size per column
+  """
+
+  def __init__(self, size, **kwargs):
+    super(ColumnwiseLinear, self).__init__(**kwargs)
+    self.size = size
+
+  def build(self, input_shape):
+    num_columns = int(input_shape[-1])
+
+    # Glorot uniform limit of each per-column Dense kernel
+    limit = np.sqrt(6. / (1 + self.size))
+    self.kernel = self.add_weight(
+        name='kernel',
+        shape=[num_columns, self.size],
+        initializer=tf.keras.initializers.RandomUniform(-limit, limit))
+    self.bias = self.add_weight(
+        name='bias', shape=[num_columns, self.size], initializer='zeros')
+    super(ColumnwiseLinear, self).build(input_shape)
+
+  def call(self, inputs):
+    return K.expand_dims(inputs, axis=-1) * self.kernel + self.bias
+
+
+class GroupedGatedResidualNetwork(tf.keras.layers.Layer):
+  """Applies a separate GRN to each variable of a grouped input.
+
+  Computes the same function as calling gated_residual_network on every
+  variable in turn, but with the weights of all variables stacked into batched
+  tensors. Inputs are transposed once to a variable-major layout, so that each
+  dense layer of the GRN is a single batched matmul over variables.
+
+  Attributes:
+    hidden_layer_size: Internal state size, also the embedding size of each
+      variable
+    dropout_rate: Dropout rate if dropout is applied
+    variable_axis: Axis of inputs along which variables are stacked
+  """
+
+  def __init__(self,
+               hidden_layer_size,
+               dropout_rate=None,
+               variable_axis=-2,
+               **kwargs):
+    super(GroupedGatedResidualNetwork, self).__init__(**kwargs)
+    self.hidden_layer_size = hidden_layer_size
+    self.dropout_rate = dropout_rate
+    self.variable_axis = variable_axis
+    if dropout_rate is not None:
+      self.dropout = Dropout(dropout_rate)
+
+  def build(self, input_shape):
+    num_variables = int(input_shape[self.variable_axis])
+    size = self.hidden_layer_size
+
+    # Glorot uniform limit of each per-variable Dense kernel
+    limit = np.sqrt(6. / (size + size))
+    initializer = tf.keras.initializers.RandomUniform(-limit, limit)
+
+    # Dense layers of the GRN, in order of application
+    self.kernels = {}
+    self.biases = {}
+    for name in ['hidden', 'output', 'activation', 'gate']:
+      self.kernels[name] = self.add_weight(
+          name=name + '_kernel',
+          shape=[num_variables, size, size],
+          initializer=initializer)
+      self.biases[name] = self.add_weight(
+          name=name + '_bias',
+          shape=[num_variables, 1, size],
+          initializer='zeros')
+
+    # Layer normalisation parameters
+    self.gamma = self.add_weight(
+        name='gamma', shape=[num_variables, 1, size], initializer='ones')
+    self.beta = self.add_weight(
+        name='beta', shape=[num_variables, 1, size], initializer='zeros')
+
+    super(GroupedGatedResidualNetwork, self).build(input_shape)
+
+  def call(self, inputs, training=None):
+    rank = len(inputs.get_shape())
+    axis = self.variable_axis % rank
+    to_variable_major = [axis] + [i for i in range(rank) if i != axis]
+    from_variable_major = list(np.argsort(to_variable_major))
+
+    # Shape=(variables, ..., hidden) flattened to (variables, ?, hidden)
+    x = tf.transpose(inputs, to_variable_major)
+    x_shape = tf.shape(x)
+    x = tf.reshape(x, [x_shape[0], -1, self.hidden_layer_size])
+
+    def linear(name, y):
+      return tf.matmul(y, self.kernels[name]) + self.biases[name]
+
+    # Apply feedforward network
+    hidden = tf.nn.elu(linear('hidden', x))
+    hidden = linear('output', hidden)
+
+    # Gated linear unit
+    if self.dropout_rate is not None:
+      hidden = self.dropout(hidden, training=training)
+    gated = linear('activation', hidden) * tf.sigmoid(linear('gate', hidden))
+
+    # Skip connection and layer normalisation
+    outputs = x + gated
+    outputs -= tf.reduce_mean(outputs, axis=-1, keepdims=True)
+    variance = tf.reduce_mean(tf.square(outputs), axis=-1, keepdims=True)
+    outputs *= tf.math.rsqrt(variance + 1e-3)  # LayerNormalization default
+    outputs = outputs * self.gamma + self.beta
+
+    return tf.transpose(tf.reshape(outputs, x_shape), from_variable_major)
+
+
+class CuDNNCompatibleLSTM(tf.compat.v1.keras.layers.CuDNNLSTM):
+  """LSTM layer with CuDNNLSTM weights that runs on CPU.
+
+  Replaces the CuDNN op with the fused BlockLSTM kernel, keeping the weights
+  of CuDNNLSTM -- including its separate input and recurrent biases, which are
+  summed before use. Checkpoints can therefore be exchanged with CuDNNLSTM, so
+  that models trained on GPU can be served on CPU.
+
+  Compared to a Keras LSTM on CPU, it is faster for small hidden sizes, but only
+  on par for larger ones -- see benchmarks/lstm_benchmark.py.
+  """
+
+  def _process_batch(self, inputs, initial_state):
+    if not self.time_major:
+      inputs = tf.transpose(inputs, perm=(1, 0, 2))
+
+    # BlockLSTM has no bfloat16 kernel, so the recurrence runs in float32
+    compute_dtype = inputs.dtype
+    dtype = tf.float32 if compute_dtype == tf.bfloat16 else compute_dtype
+
+    def cast(x):
+      return tf.cast(x, dtype)
+
+    zeros = tf.zeros([self.units], dtype=dtype)  # no peepholes
+    block_outputs = tf.raw_ops.BlockLSTMV2(
+        seq_len_max=tf.cast(tf.shape(inputs)[0], tf.int64),
+        x=cast(inputs),
+        cs_prev=cast(initial_state[1]),
+        h_prev=cast(initial_state[0]),
+        w=cast(concat([self.kernel, self.recurrent_kernel], axis=0)),
+        wci=zeros,
+        wcf=zeros,
+        wco=zeros,
+        b=cast(self.bias[:self.units * 4] + self.bias[self.units * 4:]),
+        cell_clip=-1.,  # no clipping
+        use_peephole=False)
+    c, h = [
+        tf.cast(block_outputs[i], compute_dtype) for i in [1, 6]
+    ]
+
+    if self.return_sequences:
+      output = h if self.time_major else tf.transpose(h, perm=(1, 0, 2))
+    else:
+      output = h[-1]
+    return output, [h[-1], c[-1]]
+
+
 # Attention Components.
+@functools.lru_cache(maxsize=None)
+def _get_causal_mask(len_s):
+  """Returns additive causal mask of shape=(len_s, len_s) as a numpy array."""
+  return np.triu(np.full([len_s, len_s], -1e+9, dtype=np.float32), k=1)
+
+
 def get_decoder_mask(self_attn_inputs):
   """Returns causal mask to apply for self-attention layer.
 
+  The mask is an additive constant of shape=(T, T) -- zero for past and
+  present time steps and very large negative values for future ones -- which
+  is broadcast across the batch by the attention layer.
+
   Args:
     self_attn_inputs: Inputs to self attention layer to determine mask shape
   """
-  len_s = tf.shape(self_attn_inputs)[1]
-  bs = tf.shape(self_attn_inputs)[:1]
-  mask = K.cumsum(tf.eye(len_s, batch_shape=bs), 1)
-  return mask
+  len_s = self_attn_inputs.get_shape().as_list()[1]
+  return tf.constant(_get_causal_mask(len_s))
 
 
 class ScaledDotProductAttention():
   """Defines scaled dot product attention layer.
 
+  Attention is computed for all heads at once, with queries and keys split
+  into heads along their penultimate axis and values shared across heads.
+
+  With chunk_size set, keys are processed in blocks with an online softmax, so
+  that scores are only held for one block of keys at a time.
+
   Attributes:
     dropout: Dropout rate to use
     activation: Normalisation function for scaled dot product attention (e.g.
       softmax by default)
+    chunk_size: Number of keys per block, or 0 to process all keys at once
   """
 
-  def __init__(self, attn_dropout=0.0):
+  def __init__(self, attn_dropout=0.0, chunk_size=0):
     self.dropout = Dropout(attn_dropout)
     self.activation = Activation('softmax')
+    self.chunk_size = chunk_size
 
   def __call__(self, q, k, v, mask):
     """Applies scaled dot product attention.
 
     Args:
-      q: Queries
-      k: Keys
-      v: Values
-      mask: Masking if required -- sets softmax to very large value
+      q: Queries of shape=(?, T, n_head, d_k)
+      k: Keys of shape=(?, T, n_head, d_k)
+      v: Values of shape=(?, T, d_v), shared across heads
+      mask: Additive mask of shape=(q, k) if required -- sets masked scores to
+        very large negative values before the softmax
 
     Returns:
-      Tuple of (layer outputs, attention weights)
+      Tuple of (layer outputs, attention weights), with heads along the first
+      axis. In chunked mode, attention weights are averaged over heads, and
+      only computed if evaluated.
     """
-    temper = tf.sqrt(tf.cast(tf.shape(k)[-1], dtype='float32'))
-    attn = Lambda(lambda x: K.batch_dot(x[0], x[1], axes=[2, 2]) / temper)(
-        [q, k])  # shape=(batch, q, k)
-    if mask is not None:
-      mmask = Lambda(lambda x: (-1e+9) * (1. - K.cast(x, 'float32')))(
-          mask)  # setting to infinity
-      attn = Add()([attn, mmask])
+    def get_scores(x, start=0, end=None):
+      """Returns scaled and masked scores for keys in [start, end)."""
+      temper = tf.sqrt(tf.cast(tf.shape(x[1])[-1], dtype=x[0].dtype))
+      scores = tf.einsum('bqhd,bkhd->hbqk', x[0], x[1][:, start:end]) / temper
+      if mask is not None:
+        # Broadcast over head & batch, in the compute dtype of the scores
+        scores += tf.cast(mask[:, start:end], scores.dtype)
+      return scores  # shape=(head, batch, q, k)
+
+    len_k = k.get_shape().as_list()[1]
+    if self.chunk_size and self.chunk_size < len_k:
+      output = Lambda(lambda x: self._apply_chunked(x, get_scores, len_k))(
+          [q, k, v])
+      attn = Lambda(lambda x: K.mean(
+          self.activation(get_scores(x)), axis=0, keepdims=True))([q, k])
+      return output, attn
+
+    attn = Lambda(get_scores)([q, k])
     attn = self.activation(attn)
     attn = self.dropout(attn)
-    output = Lambda(lambda x: K.batch_dot(x[0], x[1]))([attn, v])
+    output = Lambda(lambda x: tf.einsum('hbqk,bkd->hbqd', x[0], x[1]))(
+        [attn, v])
     return output, attn
 
+  def _apply_chunked(self, x, get_scores, len_k):
+    """Returns attention outputs, accumulated over blocks of keys.
+
+    Args:
+      x: List of [queries, keys, values]
+      get_scores: Function returning scores for a block of keys
+      len_k: Number of keys
+
+    Returns:
+      Layer outputs of shape=(head, ?, T, d_v).
+    """
+    v = x[2]
+    output = None
+    for start in range(0, len_k, self.chunk_size):
+      end = min(start + self.chunk_size, len_k)
+      scores = get_scores(x, start, end)
+      block_max = tf.reduce_max(scores, axis=-1, keepdims=True)
+
+      # Rescale previous blocks when the running maximum increases
+      if output is None:
+        running_max = block_max
+      else:
+        new_max = tf.maximum(running_max, block_max)
+        rescale = tf.exp(running_max - new_max)
+        running_max = new_max
+
+      weights = tf.exp(scores - running_max)
+      block_sum = tf.reduce_sum(weights, axis=-1, keepdims=True)
+      block_output = tf.einsum('hbqk,bkd->hbqd', self.dropout(weights),
+                               v[:, start:end])
+
+      if output is None:
+        normaliser, output = block_sum, block_output
+      else:
+        normaliser = normaliser * rescale + block_sum
+        output = output * rescale + block_output
+
+    return output / normaliser
+
 
 class InterpretableMultiHeadAttention():
   """Defines interpretable multi-head attention layer.
@@ -284,40 +526,38 @@ class InterpretableMultiHeadAttention():
     d_k: Key/query dimensionality per head
     d_v: Value dimensionality
     dropout: Dropout rate to apply
-    qs_layers: List of queries across heads
-    ks_layers: List of keys across heads
-    vs_layers: List of values across heads
+    qs_layer: Query projection for all heads
+    ks_layer: Key projection for all heads
+    vs_layer: Value projection shared across heads
     attention: Scaled dot product attention layer
     w_o: Output weight matrix to project internal state to the original TFT
       state size
   """
 
-  def __init__(self, n_head, d_model, dropout):
+  def __init__(self, n_head, d_model, dropout, chunk_size=0):
     """Initialises layer.
 
     Args:
       n_head: Number of heads
       d_model: TFT state dimensionality
       dropout: Dropout discard rate
+      chunk_size: Number of keys per attention block, or 0 to attend over all
+        keys at once
     """
 
     self.n_head = n_head
     self.d_k = self.d_v = d_k = d_v = d_model // n_head
     self.dropout = dropout
 
-    self.qs_layers = []
-    self.ks_layers = []
-    self.vs_layers = []
+    # Heads are projected together, with per-head weights stacked along the
+    # output axis.
+    self.qs_layer = Dense(n_head * d_k, use_bias=False)
+    self.ks_layer = Dense(n_head * d_k, use_bias=False)
 
     # Use same value layer to facilitate interp
-    vs_layer = Dense(d_v, use_bias=False)
+    self.vs_layer = Dense(d_v, use_bias=False)
 
-    for _ in range(n_head):
-      self.qs_layers.append(Dense(d_k, use_bias=False))
-      self.ks_layers.append(Dense(d_k, use_bias=False))
-      self.vs_layers.append(vs_layer)  # use same vs_layer
-
-    self.attention = ScaledDotProductAttention()
+    self.attention = ScaledDotProductAttention(chunk_size=chunk_size)
     self.w_o = Dense(d_model, use_bias=False)
 
   def __call__(self, q, k, v, mask=None):
@@ -329,38 +569,191 @@ class InterpretableMultiHeadAttention():
       q: Query tensor of shape=(?, T, d_model)
       k: Key of shape=(?, T, d_model)
       v: Values of shape=(?, T, d_model)
-      mask: Masking if required with shape=(?, T, T)
+      mask: Additive masking if required with shape=(T, T)
 
     Returns:
       Tuple of (layer outputs, attention weights)
     """
-    n_head = self.n_head
-
-    heads = []
-    attns = []
-    for i in range(n_head):
-      qs = self.qs_layers[i](q)
-      ks = self.ks_layers[i](k)
-      vs = self.vs_layers[i](v)
-      head, attn = self.attention(qs, ks, vs, mask)
-
-      head_dropout = Dropout(self.dropout)(head)
-      heads.append(head_dropout)
-      attns.append(attn)
-    head = K.stack(heads) if n_head > 1 else heads[0]
-    attn = K.stack(attns)
-
-    outputs = K.mean(head, axis=0) if n_head > 1 else head
+    split_heads = tf.keras.layers.Reshape((-1, self.n_head, self.d_k))
+
+    qs = split_heads(self.qs_layer(q))
+    ks = split_heads(self.ks_layer(k))
+    vs = self.vs_layer(v)
+    head, attn = self.attention(qs, ks, vs, mask)
+
+    head = Dropout(self.dropout)(head)
+    outputs = K.mean(head, axis=0)
     outputs = self.w_o(outputs)
     outputs = Dropout(self.dropout)(outputs)  # output dropout
 
     return outputs, attn
 
 
+# Parallel batching.
+# Window sources and outputs of the current parallel batching job, inherited by
+# forked workers so that they are shared rather than pickled.
+_shard_state = None
+
+
+def _get_shared_array(shape, dtype):
+  """Returns an array backed by anonymous shared memory.
+
+  Memory is shared with worker processes forked after allocation, so that
+  writes made by workers are seen by the parent.
+  """
+  dtype = np.dtype(dtype)
+  count = int(np.prod(shape))
+  buffer = mmap.mmap(-1, max(count * dtype.itemsize, 1))
+  return np.frombuffer(buffer, dtype=dtype, count=count).reshape(shape)
+
+
+def _fill_window_shard(shard):
+  """Gathers windows for a shard of start rows into shared arrays."""
+  begin, end = shard
+  start_indices, time_steps, windows = _shard_state
+  for source, output, first_step in windows:
+    output[begin:end] = utils.sliding_windows(
+        source, time_steps)[start_indices[begin:end], first_step:]
+
+
 class TFTDataCache(object):
-  """Caches data for the TFT."""
+  """Caches data for the TFT.
+
+  Entries are held in memory as read-only arrays, with the least recently
+  used entries evicted once an optional memory limit is exceeded. Once a disk
+  folder is enabled, entries are also persisted as .npy files under a
+  fingerprint of the source data and batching settings, and are memory-mapped
+  back in by later runs or after eviction.
+  """
+
+  # Bump whenever the layout of cached arrays changes, to invalidate old entries
+  _format_version = 3
+
+  _data_cache = collections.OrderedDict()
+  _entry_sizes = {}
+  _max_memory_bytes = None
+  _disk_folder = None
+  _stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+  @classmethod
+  def set_memory_limit(cls, max_memory_bytes):
+    """Sets maximum number of bytes held in memory (None for no limit)."""
+    cls._max_memory_bytes = max_memory_bytes
+    cls._evict()
+
+  @classmethod
+  def get_stats(cls):
+    """Returns dictionary of cache counters and current memory footprint."""
+    stats = dict(cls._stats)
+    stats['entries'] = len(cls._data_cache)
+    stats['bytes'] = sum(cls._entry_sizes.values())
+    return stats
+
+  @classmethod
+  def _insert(cls, data, key):
+    """Stores read-only views of data in memory and enforces memory limit."""
+
+    def _read_only(array):
+      view = array.view()
+      view.flags.writeable = False
+      return view
+
+    data = {k: _read_only(np.asanyarray(data[k])) for k in data}
+
+    cls._entry_sizes[key] = cls._get_memory_size(data)
+    cls._data_cache[key] = data
+    cls._data_cache.move_to_end(key)
+    cls._evict()
 
-  _data_cache = {}
+    return data
+
+  @staticmethod
+  def _get_memory_size(data):
+    """Returns number of bytes of memory held by arrays in data.
+
+    Views -- e.g. sliding windows, or outputs sliced from inputs -- are
+    counted through the buffers they are based on, so that memory shared by
+    several arrays or windows is only counted once.
+    """
+    buffers = {}
+    for array in data.values():
+      # Memory-mapped arrays are backed by disk, so are not counted
+      if isinstance(array, np.memmap):
+        continue
+
+      base = array
+      while getattr(base, 'base', None) is not None:
+        base = base.base
+      if isinstance(base, np.ndarray):
+        buffers[id(base)] = base.nbytes
+      else:  # e.g. shared memory of parallel batching
+        buffers[id(base)] = memoryview(base).nbytes
+
+    return sum(buffers.values())
+
+  @classmethod
+  def _evict(cls):
+    """Evicts least recently used entries until under the memory limit."""
+    if cls._max_memory_bytes is None:
+      return
+
+    # The most recent entry is always kept, even if it exceeds the limit alone
+    while len(cls._data_cache) > 1 and \
+        sum(cls._entry_sizes.values()) > cls._max_memory_bytes:
+      key, _ = cls._data_cache.popitem(last=False)
+      del cls._entry_sizes[key]
+      cls._stats['evictions'] += 1
+      print('Evicted cached data "{}"'.format(key))
+
+  @classmethod
+  def enable_disk_cache(cls, cache_folder, data_path, column_definition,
+                        total_time_steps, num_encoder_steps, num_samples):
+    """Enables persistent storage of cached data on disk.
+
+    Args:
+      cache_folder: Root folder for all disk cache entries
+      data_path: Path to source data file, or folder of part files, used to
+        create entries
+      column_definition: Column definition used for batching
+      total_time_steps: Total number of time steps per window
+      num_encoder_steps: Number of encoder steps per window
+      num_samples: Sample counts used when batching entries
+    """
+
+    # Partitioned data is a folder of part files, hashed in order
+    data_files = [data_path]
+    if os.path.isdir(data_path):
+      data_files = [
+          os.path.join(data_path, f) for f in sorted(os.listdir(data_path))
+      ]
+
+    hasher = hashlib.sha256()
+    for data_file in data_files:
+      with open(data_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+          hasher.update(chunk)
+
+    settings = {
+        'cache_format': cls._format_version,
+        'column_definition': [[tup[0], int(tup[1]), int(tup[2])]
+                              for tup in column_definition],
+        'total_time_steps': int(total_time_steps),
+        'num_encoder_steps': int(num_encoder_steps),
+        'num_samples': list(num_samples)
+    }
+    hasher.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+
+    cls._disk_folder = os.path.join(cache_folder, hasher.hexdigest()[:16])
+    utils.create_folder_if_not_exist(cls._disk_folder)
+
+    print('Using disk cache at {}'.format(cls._disk_folder))
+
+  @classmethod
+  def _get_disk_path(cls, key):
+    """Returns folder storing arrays for key, or None if disk is disabled."""
+    if cls._disk_folder is None:
+      return None
+    return os.path.join(cls._disk_folder, key)
 
   @classmethod
   def update(cls, data, key):
@@ -370,18 +763,61 @@ class TFTDataCache(object):
       data: Source to update
       key: Key to dictionary location
     """
-    cls._data_cache[key] = data
+    cls._insert(data, key)
+
+    path = cls._get_disk_path(key)
+    if path is not None:
+      # Write to a temporary folder first so partial entries are never read
+      tmp_path = path + '.tmp'
+      if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+      os.makedirs(tmp_path)
+      for k in data:
+        np.save(os.path.join(tmp_path, k + '.npy'), data[k], allow_pickle=True)
+      if os.path.exists(path):
+        shutil.rmtree(path)
+      os.rename(tmp_path, path)
+
+  @classmethod
+  def _load_from_disk(cls, key):
+    """Loads arrays for key from disk, memory-mapping where possible."""
+    path = cls._get_disk_path(key)
+
+    print('Loading cached data "{}" from {}'.format(key, path))
+    data = {}
+    for filename in sorted(os.listdir(path)):
+      name, _ = os.path.splitext(filename)
+      array_path = os.path.join(path, filename)
+      try:
+        data[name] = np.load(array_path, mmap_mode='r')
+      except ValueError:  # object arrays cannot be memory-mapped
+        data[name] = np.load(array_path, allow_pickle=True)
+
+    return data
 
   @classmethod
   def get(cls, key):
-    """Returns data stored at key location."""
-    return cls._data_cache[key].copy()
+    """Returns read-only arrays stored at key location."""
+    if key in cls._data_cache:
+      cls._stats['hits'] += 1
+      cls._data_cache.move_to_end(key)
+      data = cls._data_cache[key]
+    else:
+      cls._stats['misses'] += 1
+      if not cls.contains(key):
+        raise KeyError('Cached data "{}" not found!'.format(key))
+      data = cls._insert(cls._load_from_disk(key), key)
+
+    return dict(data)
 
   @classmethod
   def contains(cls, key):
     """Retuns boolean indicating whether key is present in cache."""
 
-    return key in cls._data_cache
+    path = cls._get_disk_path(key)
+
+    return key in cls._data_cache or (path is not None and
+                                      os.path.isdir(path))
 
 
 # TFT model definitions.
@@ -414,6 +850,12 @@ class TemporalFusionTransformer(object):
     num_stacks: Number of self-attention layers to apply (default is 1 for basic
       TFT)
     num_heads: Number of heads for interpretable mulit-head attention
+    attention_chunk_size: Number of keys per block for memory-efficient
+      decoder self-attention, or 0 to attend over all keys at once
+    horizon_only_attention: Whether decoder self-attention and subsequent
+      layers are only computed for forecast horizon positions
+    precision_policy: Name of Keras precision policy used to build the model
+      -- 'float32', 'mixed_float16' or 'mixed_bfloat16'
     model: Keras model for TFT
   """
 
@@ -447,7 +889,7 @@ class TemporalFusionTransformer(object):
     self.column_definition = params['column_definition']
 
     # Network params
-    self.quantiles = [0.1, 0.5, 0.9]
+    self.quantiles = json.loads(str(params.get('quantiles', [0.1, 0.5, 0.9])))
     self.use_cudnn = use_cudnn  # Whether to use GPU optimised LSTM
     self.hidden_layer_size = int(params['hidden_layer_size'])
     self.dropout_rate = float(params['dropout_rate'])
@@ -460,6 +902,10 @@ class TemporalFusionTransformer(object):
     self.num_encoder_steps = int(params['num_encoder_steps'])
     self.num_stacks = int(params['stack_size'])
     self.num_heads = int(params['num_heads'])
+    self.attention_chunk_size = int(params.get('attention_chunk_size', 0))
+    self.horizon_only_attention = str(
+        params.get('horizon_only_attention', False)) == 'True'
+    self.precision_policy = str(params.get('precision_policy', 'float32'))
 
     # Serialisation options
     self._temp_folder = os.path.join(params['model_folder'], 'tmp')
@@ -481,7 +927,8 @@ class TemporalFusionTransformer(object):
     """Transforms raw inputs to embeddings.
 
     Applies linear transformation onto continuous variables and uses embeddings
-    for categorical variables.
+    for categorical variables. All variables are embedded together, so that
+    each embedding is computed once and shared by the input groups using it.
 
     Args:
       all_inputs: Inputs to transform
@@ -490,8 +937,6 @@ class TemporalFusionTransformer(object):
       Tensors for transformed inputs.
     """
 
-    time_steps = self.time_steps
-
     # Sanity checks
     for i in self._known_regular_input_idx:
       if i in self._input_obs_loc:
@@ -508,93 +953,90 @@ class TemporalFusionTransformer(object):
     num_categorical_variables = len(self.category_counts)
     num_regular_variables = self.input_size - num_categorical_variables
 
-    embedding_sizes = [
-        self.hidden_layer_size for i, size in enumerate(self.category_counts)
-    ]
-
-    embeddings = []
-    for i in range(num_categorical_variables):
-
-      embedding = tf.keras.Sequential([
-          tf.keras.layers.InputLayer([time_steps]),
-          tf.keras.layers.Embedding(
-              self.category_counts[i],
-              embedding_sizes[i],
-              input_length=time_steps,
-              dtype=tf.float32)
-      ])
-      embeddings.append(embedding)
-
     regular_inputs, categorical_inputs \
         = all_inputs[:, :, :num_regular_variables], \
           all_inputs[:, :, num_regular_variables:]
 
-    embedded_inputs = [
-        embeddings[i](categorical_inputs[Ellipsis, i])
-        for i in range(num_categorical_variables)
-    ]
+    # Fused embeddings, shape=(?, T, num_variables, hidden_layer_size). Each
+    # real-valued column has its own linear transformation, and categorical
+    # variables share one table with a block of rows per variable.
+    if num_regular_variables:
+      regular_embeddings = ColumnwiseLinear(self.hidden_layer_size)(
+          regular_inputs)
+
+    if num_categorical_variables:
+      category_offsets = np.cumsum([0] + self.category_counts[:-1])
+      categorical_ids = K.cast(categorical_inputs, 'int32') \
+          + category_offsets.astype(np.int32)
+      categorical_embeddings = tf.keras.layers.Embedding(
+          sum(self.category_counts), self.hidden_layer_size)(
+              categorical_ids)
+
+    def get_variables(regular_idx, categorical_idx):
+      """Returns embeddings stacked along the last axis, or None if empty."""
+      variables = []
+      if regular_idx:
+        variables.append(tf.gather(regular_embeddings, regular_idx, axis=2))
+      if categorical_idx:
+        variables.append(
+            tf.gather(categorical_embeddings, categorical_idx, axis=2))
+      if not variables:
+        return None
+      return K.permute_dimensions(concat(variables, axis=2), [0, 1, 3, 2])
 
     # Static inputs
-    if self._static_input_loc:
-      static_inputs = [tf.keras.layers.Dense(self.hidden_layer_size)(
-          regular_inputs[:, 0, i:i + 1]) for i in range(num_regular_variables)
-                       if i in self._static_input_loc] \
-          + [embedded_inputs[i][:, 0, :]
-             for i in range(num_categorical_variables)
-             if i + num_regular_variables in self._static_input_loc]
-      static_inputs = tf.keras.backend.stack(static_inputs, axis=1)
+    static_regular_idx = [
+        i for i in range(num_regular_variables) if i in self._static_input_loc
+    ]
+    static_categorical_idx = [
+        i for i in range(num_categorical_variables)
+        if i + num_regular_variables in self._static_input_loc
+    ]
+    if static_regular_idx or static_categorical_idx:
+      static_inputs = []
+      if static_regular_idx:
+        # Static real-valued inputs use separate transformations from their
+        # time-varying counterparts
+        static_inputs.append(
+            ColumnwiseLinear(self.hidden_layer_size)(tf.gather(
+                regular_inputs[:, 0, :], static_regular_idx, axis=-1)))
+      if static_categorical_idx:
+        static_inputs.append(
+            tf.gather(
+                categorical_embeddings[:, 0, :, :],
+                static_categorical_idx,
+                axis=1))
+      static_inputs = concat(static_inputs, axis=1)
 
     else:
       static_inputs = None
 
-    def convert_real_to_embedding(x):
-      """Applies linear transformation for time-varying inputs."""
-      return tf.keras.layers.TimeDistributed(
-          tf.keras.layers.Dense(self.hidden_layer_size))(
-              x)
-
     # Targets
-    obs_inputs = tf.keras.backend.stack([
-        convert_real_to_embedding(regular_inputs[Ellipsis, i:i + 1])
-        for i in self._input_obs_loc
-    ],
-                                        axis=-1)
+    obs_inputs = get_variables(list(self._input_obs_loc), [])
 
     # Observed (a prioir unknown) inputs
-    wired_embeddings = []
-    for i in range(num_categorical_variables):
-      if i not in self._known_categorical_input_idx \
-        and  i + num_regular_variables  not in self._input_obs_loc:
-        e = embeddings[i](categorical_inputs[:, :, i])
-        wired_embeddings.append(e)
-
-    unknown_inputs = []
-    for i in range(regular_inputs.shape[-1]):
-      if i not in self._known_regular_input_idx \
-          and i not in self._input_obs_loc:
-        e = convert_real_to_embedding(regular_inputs[Ellipsis, i:i + 1])
-        unknown_inputs.append(e)
-
-    if unknown_inputs + wired_embeddings:
-      unknown_inputs = tf.keras.backend.stack(
-          unknown_inputs + wired_embeddings, axis=-1)
-    else:
-      unknown_inputs = None
+    unknown_inputs = get_variables(
+        [
+            i for i in range(num_regular_variables)
+            if i not in self._known_regular_input_idx and
+            i not in self._input_obs_loc
+        ],
+        [
+            i for i in range(num_categorical_variables)
+            if i not in self._known_categorical_input_idx and
+            i + num_regular_variables not in self._input_obs_loc
+        ])
 
     # A priori known inputs
-    known_regular_inputs = [
-        convert_real_to_embedding(regular_inputs[Ellipsis, i:i + 1])
-        for i in self._known_regular_input_idx
-        if i not in self._static_input_loc
-    ]
-    known_categorical_inputs = [
-        embedded_inputs[i]
-        for i in self._known_categorical_input_idx
-        if i + num_regular_variables not in self._static_input_loc
-    ]
-
-    known_combined_layer = tf.keras.backend.stack(
-        known_regular_inputs + known_categorical_inputs, axis=-1)
+    known_combined_layer = get_variables(
+        [
+            i for i in self._known_regular_input_idx
+            if i not in self._static_input_loc
+        ],
+        [
+            i for i in self._known_categorical_input_idx
+            if i + num_regular_variables not in self._static_input_loc
+        ])
 
     return unknown_inputs, known_combined_layer, obs_inputs, static_inputs
 
@@ -604,6 +1046,15 @@ class TemporalFusionTransformer(object):
     return utils.get_single_col_by_input_type(input_type,
                                               self.column_definition)
 
+  def _get_target_cols(self):
+    """Returns names of target columns, in order of model outputs."""
+
+    return [
+        tup[0]
+        for tup in self.column_definition
+        if tup[2] == InputTypes.TARGET
+    ]
+
   def training_data_cached(self):
     """Returns boolean indicating if training data has been cached."""
 
@@ -612,6 +1063,8 @@ class TemporalFusionTransformer(object):
   def cache_batched_data(self, data, cache_key, num_samples=-1):
     """Batches and caches data once for using during training.
 
+    Windows are gathered in parallel by n_multiprocessing_workers processes.
+
     Args:
       data: Data to batch and cache
       cache_key: Key used for cache
@@ -620,18 +1073,157 @@ class TemporalFusionTransformer(object):
 
     if num_samples > 0:
       TFTDataCache.update(
-          self._batch_sampled_data(data, max_samples=num_samples), cache_key)
+          self._batch_sampled_data(
+              data,
+              max_samples=num_samples,
+              num_workers=self.n_multiprocessing_workers), cache_key)
     else:
-      TFTDataCache.update(self._batch_data(data), cache_key)
+      TFTDataCache.update(
+          self._batch_data(data, num_workers=self.n_multiprocessing_workers),
+          cache_key)
 
     print('Cached data "{}" updated'.format(cache_key))
 
-  def _batch_sampled_data(self, data, max_samples):
+  def _get_window_sources(self, data):
+    """Returns flat column arrays from which batched windows are gathered.
+
+    Args:
+      data: DataFrame sorted by entity, with rows in time order per entity
+
+    Returns:
+      Dictionary of arrays with one row per data row, sharing a single
+      contiguous float32 matrix for inputs and outputs. Identifiers are int32
+      codes into an 'identifier_lookup' table of the original identifiers,
+      and dates are datetime64.
+    """
+
+    id_col = self._get_single_col_by_type(InputTypes.ID)
+    time_col = self._get_single_col_by_type(InputTypes.TIME)
+    input_cols = [
+        tup[0]
+        for tup in self.column_definition
+        if tup[2] not in {InputTypes.ID, InputTypes.TIME}
+    ]
+
+    inputs = np.ascontiguousarray(data[input_cols].values, dtype=np.float32)
+    target_idx = [input_cols.index(col) for col in self._get_target_cols()]
+
+    # Adjacent targets are sliced as a view of the input matrix
+    if np.all(np.diff(target_idx) == 1):
+      outputs = inputs[:, target_idx[0]:target_idx[-1] + 1]
+    else:
+      outputs = inputs[:, target_idx]
+
+    identifier_codes, identifier_lookup = pd.factorize(data[id_col])
+
+    # String identifiers are stored as fixed-width unicode, rather than as an
+    # object array, so that they can be memory-mapped
+    identifier_lookup = np.asarray(identifier_lookup)
+    if pd.api.types.infer_dtype(identifier_lookup) == 'string':
+      identifier_lookup = identifier_lookup.astype('U')
+
+    time = data[time_col].values
+    time_type = [tup[1] for tup in self.column_definition
+                 if tup[0] == time_col][0]
+    if time_type == DataTypes.DATE:
+      time = pd.to_datetime(data[time_col]).values
+
+    return {
+        'identifier': identifier_codes.astype(np.int32),
+        'identifier_lookup': identifier_lookup,
+        'time': time,
+        'outputs': outputs,
+        'inputs': inputs
+    }
+
+  def _get_windows(self, sources, start_indices=None, num_workers=1):
+    """Returns batched windows of window sources.
+
+    Args:
+      sources: Window sources, as returned by _get_window_sources
+      start_indices: Optional row indices at which windows should start
+      num_workers: Number of processes used to gather windows
+
+    Returns:
+      Dictionary of batched data, dropping encoder steps from outputs. Only a
+      single identifier code is kept per window, while times are kept per data
+      row and indexed by the start row of each window.
+    """
+
+    if start_indices is not None and len(start_indices) and num_workers > 1 \
+        and 'fork' in multiprocessing.get_all_start_methods():
+      data_map = self._get_windows_in_parallel(sources, start_indices,
+                                               num_workers)
+    else:
+      # Only decoder steps of targets are gathered
+      data_map = {
+          k: utils.sliding_windows(sources[k], self.time_steps)[
+              slice(None) if start_indices is None else start_indices,
+              first_step:]
+          for k, first_step in [('outputs', self.num_encoder_steps),
+                                ('inputs', 0)]
+      }
+
+    if start_indices is None:
+      start_indices = np.arange(len(data_map['inputs']), dtype=np.int64)
+    data_map['window_start'] = start_indices
+    data_map['identifier'] = sources['identifier'][start_indices]
+    data_map['identifier_lookup'] = sources['identifier_lookup']
+    data_map['time'] = sources['time']
+    data_map['active_entries'] = np.ones_like(data_map['outputs'])
+
+    return data_map
+
+  def _get_windows_in_parallel(self, sources, start_indices, num_workers):
+    """Gathers input and output windows with a pool of forked processes.
+
+    Windows are split into contiguous shards which keep the windows of each
+    entity together, and each worker copies its shards into arrays in shared
+    memory. As every shard is written to a fixed location, results are
+    identical to serial batching regardless of scheduling.
+
+    Args:
+      sources: Window sources, as returned by _get_window_sources
+      start_indices: Row indices at which windows should start
+      num_workers: Number of processes to use
+
+    Returns:
+      Dictionary of shared-memory arrays for inputs and decoder outputs.
+    """
+    global _shard_state
+
+    num_windows = len(start_indices)
+    windows = []
+    for k, first_step in [('outputs', self.num_encoder_steps), ('inputs', 0)]:
+      source = sources[k]
+      shape = (num_windows, self.time_steps - first_step) + source.shape[1:]
+      windows.append((source, _get_shared_array(shape, source.dtype),
+                      first_step))
+
+    boundaries = utils.get_shard_boundaries(
+        sources['identifier'][start_indices], num_workers)
+    shards = list(zip(boundaries[:-1], boundaries[1:]))
+
+    print('Batching {} windows in {} shards'.format(num_windows, len(shards)))
+    _shard_state = (start_indices, self.time_steps, windows)
+    try:
+      with multiprocessing.get_context('fork').Pool(len(shards)) as pool:
+        pool.map(_fill_window_shard, shards)
+    finally:
+      _shard_state = None
+
+    return {'outputs': windows[0][1], 'inputs': windows[1][1]}
+
+  def _batch_sampled_data(self, data, max_samples, num_workers=1):
     """Samples segments into a compatible format.
 
+    Valid windows are located through a per-entity offset table, with all
+    sample locations drawn at once and gathered by fancy indexing.
+
     Args:
       data: Sources data to sample and batch
       max_samples: Maximum number of samples in batch
+      num_workers: Number of processes used to gather windows
 
     Returns:
       Dictionary of batched data with the maximum samples specified.
@@ -647,135 +1239,127 @@ class TemporalFusionTransformer(object):
     data.sort_values(by=[id_col, time_col], inplace=True)
 
     print('Getting valid sampling locations.')
-    valid_sampling_locations = []
-    split_data_map = {}
-    for identifier, df in data.groupby(id_col):
-      print('Getting locations for {}'.format(identifier))
-      num_entries = len(df)
-      if num_entries >= self.time_steps:
-        valid_sampling_locations += [
-            (identifier, self.time_steps + i)
-            for i in range(num_entries - self.time_steps + 1)
-        ]
-      split_data_map[identifier] = df
-
-    inputs = np.zeros((max_samples, self.time_steps, self.input_size))
-    outputs = np.zeros((max_samples, self.time_steps, self.output_size))
-    time = np.empty((max_samples, self.time_steps, 1), dtype=object)
-    identifiers = np.empty((max_samples, self.time_steps, 1), dtype=object)
-
-    if max_samples > 0 and len(valid_sampling_locations) > max_samples:
+    entity_starts, entity_lengths = utils.get_entity_offsets(
+        data[id_col].values)
+    num_windows = utils.get_num_windows(entity_lengths, self.time_steps)
+    num_locations = int(num_windows.sum())
+
+    if num_locations > max_samples:
       print('Extracting {} samples...'.format(max_samples))
-      ranges = [
-          valid_sampling_locations[i] for i in np.random.choice(
-              len(valid_sampling_locations), max_samples, replace=False)
-      ]
+      sample_indices = np.random.choice(
+          num_locations, max_samples, replace=False)
     else:
       print('Max samples={} exceeds # available segments={}'.format(
-          max_samples, len(valid_sampling_locations)))
-      ranges = valid_sampling_locations
+          max_samples, num_locations))
+      sample_indices = np.arange(num_locations)
 
-    id_col = self._get_single_col_by_type(InputTypes.ID)
-    time_col = self._get_single_col_by_type(InputTypes.TIME)
-    target_col = self._get_single_col_by_type(InputTypes.TARGET)
-    input_cols = [
-        tup[0]
-        for tup in self.column_definition
-        if tup[2] not in {InputTypes.ID, InputTypes.TIME}
-    ]
-
-    for i, tup in enumerate(ranges):
-      if (i + 1 % 1000) == 0:
-        print(i + 1, 'of', max_samples, 'samples done...')
-      identifier, start_idx = tup
-      sliced = split_data_map[identifier].iloc[start_idx -
-                                               self.time_steps:start_idx]
-      inputs[i, :, :] = sliced[input_cols]
-      outputs[i, :, :] = sliced[[target_col]]
-      time[i, :, 0] = sliced[time_col]
-      identifiers[i, :, 0] = sliced[id_col]
-
-    sampled_data = {
-        'inputs': inputs,
-        'outputs': outputs[:, self.num_encoder_steps:, :],
-        'active_entries': np.ones_like(outputs[:, self.num_encoder_steps:, :]),
-        'time': time,
-        'identifier': identifiers
-    }
+    start_indices = utils.get_window_starts(entity_starts, num_windows,
+                                            sample_indices)
 
-    return sampled_data
+    return self._get_windows(self._get_window_sources(data), start_indices,
+                             num_workers)
 
-  def _batch_data(self, data):
+  def _batch_data(self, data, num_workers=1):
     """Batches data for training.
 
     Converts raw dataframe from a 2-D tabular format to a batched 3-D array
-    to feed into Keras model.
+    to feed into Keras model. All windows are generated in a single pass over
+    a contiguous float32 matrix sorted by entity, using strided views so that
+    only the final gathered arrays are materialised.
 
     Args:
       data: DataFrame to batch
+      num_workers: Number of processes used to gather windows
 
     Returns:
       Batched Numpy array with shape=(?, self.time_steps, self.input_size)
     """
 
-    # Functions.
-    def _batch_single_entity(input_data):
-      time_steps = len(input_data)
-      lags = self.time_steps
-      x = input_data.values
-      if time_steps >= lags:
-        return np.stack(
-            [x[i:time_steps - (lags - 1) + i, :] for i in range(lags)], axis=1)
-
-      else:
-        return None
-
     id_col = self._get_single_col_by_type(InputTypes.ID)
-    time_col = self._get_single_col_by_type(InputTypes.TIME)
-    target_col = self._get_single_col_by_type(InputTypes.TARGET)
-    input_cols = [
-        tup[0]
-        for tup in self.column_definition
-        if tup[2] not in {InputTypes.ID, InputTypes.TIME}
-    ]
 
-    data_map = {}
-    for _, sliced in data.groupby(id_col):
+    # Stable sort keeps the original row order within each entity, matching the
+    # iteration order of groupby.
+    data = data.sort_values(by=id_col, kind='mergesort')
+    start_indices = utils.get_valid_window_starts(data[id_col].values,
+                                                  self.time_steps)
 
-      col_mappings = {
-          'identifier': [id_col],
-          'time': [time_col],
-          'outputs': [target_col],
-          'inputs': input_cols
-      }
+    # Windows across the full table are only valid when no entity boundary is
+    # crossed -- i.e. single entity data, in which case views are returned.
+    if len(start_indices) == len(data) - self.time_steps + 1:
+      start_indices = None
 
-      for k in col_mappings:
-        cols = col_mappings[k]
-        arr = _batch_single_entity(sliced[cols].copy())
+    return self._get_windows(self._get_window_sources(data), start_indices,
+                             num_workers)
 
-        if k not in data_map:
-          data_map[k] = [arr]
-        else:
-          data_map[k].append(arr)
+  def _get_streaming_dataset(self, data, shuffle=False):
+    """Returns a tf.data pipeline which lazily windows a formatted DataFrame.
 
-    # Combine all data
-    for k in data_map:
-      data_map[k] = np.concatenate(data_map[k], axis=0)
+    Only the flat float32 matrix of the DataFrame is held in memory. Windows
+    are gathered per minibatch in a parallel map.
 
-    # Shorten target so we only get decoder steps
-    data_map['outputs'] = data_map['outputs'][:, self.num_encoder_steps:, :]
+    Args:
+      data: DataFrame to stream
+      shuffle: Whether to reshuffle windows on every pass
 
-    active_entries = np.ones_like(data_map['outputs'])
-    if 'active_entries' not in data_map:
-      data_map['active_entries'] = active_entries
-    else:
-      data_map['active_entries'].append(active_entries)
+    Returns:
+      Tuple of (repeated dataset of (inputs, targets, sample weights), number
+      of minibatches per epoch).
+    """
 
-    return data_map
+    id_col = self._get_single_col_by_type(InputTypes.ID)
+
+    data = data.sort_values(by=id_col, kind='mergesort')
+    sources = self._get_window_sources(data)
+    entity_starts, entity_lengths = utils.get_entity_offsets(
+        data[id_col].values)
+    num_windows = utils.get_num_windows(entity_lengths, self.time_steps)
+    num_locations = int(num_windows.sum())
+
+    if num_locations == 0:
+      raise ValueError('No trajectories with at least {} time steps!'.format(
+          self.time_steps))
+
+    def _gather_windows(window_indices):
+      """Gathers input and target windows for flat window indices."""
+      start_indices = utils.get_window_starts(entity_starts, num_windows,
+                                              window_indices)
+      inputs = utils.sliding_windows(sources['inputs'], self.time_steps,
+                                     start_indices)
+      outputs = utils.sliding_windows(sources['outputs'], self.time_steps,
+                                      start_indices)
+      return inputs, outputs[:, self.num_encoder_steps:, :]
+
+    def _to_training_batch(window_indices):
+      """Converts a batch of window indices into Keras training inputs."""
+      inputs, outputs = tf.numpy_function(_gather_windows, [window_indices],
+                                          [tf.float32, tf.float32])
+      inputs.set_shape([None, self.time_steps, self.input_size])
+      outputs.set_shape(
+          [None, self.time_steps - self.num_encoder_steps, self.output_size])
+
+      active_flags = tf.ones(tf.shape(outputs)[:2])
+
+      return inputs, outputs, active_flags
+
+    dataset = tf.data.Dataset.range(num_locations)
+    if shuffle:
+      dataset = dataset.shuffle(num_locations, reshuffle_each_iteration=True)
+
+    # Batching before repeating keeps every pass aligned with an epoch, so that
+    # each epoch covers every window exactly once.
+    autotune = tf.data.experimental.AUTOTUNE
+    dataset = dataset.batch(self.minibatch_size) \
+        .repeat() \
+        .map(_to_training_batch, num_parallel_calls=autotune) \
+        .prefetch(autotune)
+
+    num_batches = int(np.ceil(num_locations / self.minibatch_size))
+
+    return dataset, num_batches
 
   def _get_active_locations(self, x):
     """Formats sample weights for Keras training."""
-    return (np.sum(x, axis=-1) > 0.0) * 1.0
+    return (np.sum(x, axis=-1) > 0.0).astype(np.float32)
 
   def _build_base_graph(self):
     """Returns graph defining layers of the TFT."""
@@ -840,16 +1424,9 @@ class TemporalFusionTransformer(object):
       sparse_weights = tf.keras.layers.Activation('softmax')(mlp_outputs)
       sparse_weights = K.expand_dims(sparse_weights, axis=-1)
 
-      trans_emb_list = []
-      for i in range(num_static):
-        e = gated_residual_network(
-            embedding[:, i:i + 1, :],
-            self.hidden_layer_size,
-            dropout_rate=self.dropout_rate,
-            use_time_distributed=False)
-        trans_emb_list.append(e)
-
-      transformed_embedding = concat(trans_emb_list, axis=1)
+      transformed_embedding = GroupedGatedResidualNetwork(
+          self.hidden_layer_size, dropout_rate=self.dropout_rate)(
+              embedding)
 
       combined = tf.keras.layers.Multiply()(
           [sparse_weights, transformed_embedding])
@@ -914,16 +1491,11 @@ class TemporalFusionTransformer(object):
       sparse_weights = tf.expand_dims(sparse_weights, axis=2)
 
       # Non-linear Processing & weight application
-      trans_emb_list = []
-      for i in range(num_inputs):
-        grn_output = gated_residual_network(
-            embedding[Ellipsis, i],
-            self.hidden_layer_size,
-            dropout_rate=self.dropout_rate,
-            use_time_distributed=True)
-        trans_emb_list.append(grn_output)
-
-      transformed_embedding = stack(trans_emb_list, axis=-1)
+      transformed_embedding = GroupedGatedResidualNetwork(
+          self.hidden_layer_size,
+          dropout_rate=self.dropout_rate,
+          variable_axis=-1)(
+              embedding)
 
       combined = tf.keras.layers.Multiply()(
           [sparse_weights, transformed_embedding])
@@ -936,36 +1508,29 @@ class TemporalFusionTransformer(object):
     future_features, future_flags, _ = lstm_combine_and_mask(future_inputs)
 
     # LSTM layer
-    def get_lstm(return_state):
-      """Returns LSTM cell initialized with default parameters."""
+    def get_lstm(return_state, name):
+      """Returns LSTM cell initialized with default parameters.
+
+      Both variants share weights and names, so that checkpoints can be moved
+      between GPU and CPU.
+      """
       if self.use_cudnn:
-        lstm = tf.compat.v1.keras.layers.CuDNNLSTM(
-            self.hidden_layer_size,
-            return_sequences=True,
-            return_state=return_state,
-            stateful=False,
-        )
+        lstm_class = tf.compat.v1.keras.layers.CuDNNLSTM
       else:
-        lstm = tf.compat.v1.keras.layers.CuDNNLSTM(
-            self.hidden_layer_size,
-            return_sequences=True,
-            return_state=return_state,
-            stateful=False,
-            # Additional params to ensure LSTM matches CuDNN, See TF 2.0 :
-            # (https://www.tensorflow.org/api_docs/python/tf/keras/layers/LSTM)
-            activation='tanh',
-            recurrent_activation='sigmoid',
-            recurrent_dropout=0,
-            unroll=False,
-            use_bias=True)
-      return lstm
+        lstm_class = CuDNNCompatibleLSTM
+      return lstm_class(
+          self.hidden_layer_size,
+          return_sequences=True,
+          return_state=return_state,
+          stateful=False,
+          name=name)
 
     history_lstm, state_h, state_c \
-        = get_lstm(return_state=True)(historical_features,
-                                      initial_state=[static_context_state_h,
-                                                     static_context_state_c])
+        = get_lstm(return_state=True, name='history_lstm')(
+            historical_features,
+            initial_state=[static_context_state_h, static_context_state_c])
 
-    future_lstm = get_lstm(return_state=False)(
+    future_lstm = get_lstm(return_state=False, name='future_lstm')(
         future_features, initial_state=[state_h, state_c])
 
     lstm_layer = concat([history_lstm, future_lstm], axis=1)
@@ -989,11 +1554,24 @@ class TemporalFusionTransformer(object):
 
     # Decoder self attention
     self_attn_layer = InterpretableMultiHeadAttention(
-        self.num_heads, self.hidden_layer_size, dropout=self.dropout_rate)
+        self.num_heads,
+        self.hidden_layer_size,
+        dropout=self.dropout_rate,
+        chunk_size=self.attention_chunk_size)
 
     mask = get_decoder_mask(enriched)
+
+    # Only outputs at forecast horizon positions are used, so queries -- and
+    # all position-wise layers after attention -- can be restricted to them.
+    if self.horizon_only_attention:
+      queries = enriched[:, encoder_steps:, :]
+      mask = mask[encoder_steps:, :]
+      temporal_feature_layer = temporal_feature_layer[:, encoder_steps:, :]
+    else:
+      queries = enriched
+
     x, self_att \
-        = self_attn_layer(enriched, enriched, enriched,
+        = self_attn_layer(queries, enriched, enriched,
                           mask=mask)
 
     x, _ = apply_gating_layer(
@@ -1001,7 +1579,7 @@ class TemporalFusionTransformer(object):
         self.hidden_layer_size,
         dropout_rate=self.dropout_rate,
         activation=None)
-    x = add_and_norm([x, enriched])
+    x = add_and_norm([x, queries])
 
     # Nonlinear processing on outputs
     decoder = gated_residual_network(
@@ -1032,65 +1610,80 @@ class TemporalFusionTransformer(object):
   def build_model(self):
     """Build model and defines training losses.
 
+    Layers are created under the precision policy of the model, with variables
+    kept in float32. Outputs and losses are always computed in float32.
+
     Returns:
       Fully defined Keras model.
     """
 
+    # Default float32 models leave Keras precision policies untouched
+    if self.precision_policy == 'float32':
+      return self._build_model()
+
+    policy = tf.keras.mixed_precision.Policy(self.precision_policy)
+    global_policy = tf.keras.mixed_precision.global_policy()
+    tf.keras.mixed_precision.set_global_policy(policy)
+    try:
+      return self._build_model(
+          loss_scale=policy.compute_dtype == 'float16')
+    finally:
+      tf.keras.mixed_precision.set_global_policy(global_policy)
+
+  def _build_model(self, loss_scale=False):
+    """Returns Keras model for build_model under the current global policy.
+
+    Args:
+      loss_scale: Whether to scale the loss for float16 gradients
+    """
 
     with tf.compat.v1.variable_scope(self.name):
 
       transformer_layer, all_inputs, attention_components \
           = self._build_base_graph()
 
-      outputs = tf.keras.layers.TimeDistributed(
-          tf.keras.layers.Dense(self.output_size * len(self.quantiles))) \
-          (transformer_layer[Ellipsis, self.num_encoder_steps:, :])
+      # Transformer outputs only cover the horizon in horizon-only mode
+      if not self.horizon_only_attention:
+        transformer_layer = transformer_layer[Ellipsis,
+                                              self.num_encoder_steps:, :]
 
-      self._attention_components = attention_components
+      outputs = tf.keras.layers.TimeDistributed(
+          tf.keras.layers.Dense(
+              self.output_size * len(self.quantiles), dtype='float32'),
+          dtype='float32') \
+          (transformer_layer)
+
+      # Attention weights are returned in float32, like outputs, whatever the
+      # compute dtype of the policy
+      self._attention_components = {
+          k: tf.cast(attention_components[k], tf.float32)
+          for k in attention_components
+      }
 
-      adam = tf.keras.optimizers.Adam(
+      # Graph-mode training needs the pre-2.11 optimizer, which later releases
+      # keep under tf.keras.optimizers.legacy
+      optimizers = getattr(tf.keras.optimizers, 'legacy', tf.keras.optimizers)
+      adam = optimizers.Adam(
           lr=self.learning_rate, clipnorm=self.max_gradient_norm)
 
+      # Scales the loss to keep float16 gradients from underflowing
+      if loss_scale:
+        adam = tf.keras.mixed_precision.LossScaleOptimizer(adam)
+
       model = tf.keras.Model(inputs=all_inputs, outputs=outputs)
 
       print(model.summary())
 
-      valid_quantiles = self.quantiles
-      output_size = self.output_size
+      quantiles = self.quantiles
 
-      class QuantileLossCalculator(object):
-        """Computes the combined quantile loss for prespecified quantiles.
+      def quantile_loss(a, b):
+        """Returns quantile loss summed over all quantiles.
 
-        Attributes:
-          quantiles: Quantiles to compute losses
+        Args:
+          a: Targets of shape=(?, horizon, output_size)
+          b: Predictions of shape=(?, horizon, quantiles * output_size)
         """
-
-        def __init__(self, quantiles):
-          """Initializes computer with quantiles for loss calculations.
-
-          Args:
-            quantiles: Quantiles to use for computations.
-          """
-          self.quantiles = quantiles
-
-        def quantile_loss(self, a, b):
-          """Returns quantile loss for specified quantiles.
-
-          Args:
-            a: Targets
-            b: Predictions
-          """
-          quantiles_used = set(self.quantiles)
-
-          loss = 0.
-          for i, quantile in enumerate(valid_quantiles):
-            if quantile in quantiles_used:
-              loss += utils.tensorflow_quantile_loss(
-                  a[Ellipsis, output_size * i:output_size * (i + 1)],
-                  b[Ellipsis, output_size * i:output_size * (i + 1)], quantile)
-          return loss
-
-      quantile_loss = QuantileLossCalculator(valid_quantiles).quantile_loss
+        return utils.tensorflow_multi_quantile_loss(a, b, quantiles)
 
       model.compile(
           loss=quantile_loss, optimizer=adam, sample_weight_mode='temporal')
@@ -1099,12 +1692,14 @@ class TemporalFusionTransformer(object):
 
     return model
 
-  def fit(self, train_df=None, valid_df=None):
+  def fit(self, train_df=None, valid_df=None, use_streaming=False):
     """Fits deep neural network for given training and validation data.
 
     Args:
       train_df: DataFrame for training data
       valid_df: DataFrame for validation data
+      use_streaming: Whether to generate windows lazily from the DataFrames
+        with a tf.data pipeline, rather than batching all data up front
     """
 
     print('*** Fitting {} ***'.format(self.name))
@@ -1123,6 +1718,27 @@ class TemporalFusionTransformer(object):
         tf.keras.callbacks.TerminateOnNaN()
     ]
 
+    if use_streaming:
+      if train_df is None or valid_df is None:
+        raise ValueError('Streaming mode requires training and validation '
+                         'DataFrames!')
+
+      print('Using streaming tf.data pipeline')
+      train_dataset, train_steps = self._get_streaming_dataset(
+          train_df, shuffle=True)
+      valid_dataset, valid_steps = self._get_streaming_dataset(valid_df)
+
+      self.model.fit(
+          x=train_dataset,
+          steps_per_epoch=train_steps,
+          epochs=self.num_epochs,
+          validation_data=valid_dataset,
+          validation_steps=valid_steps,
+          callbacks=callbacks)
+
+      self._load_best_checkpoint()
+      return
+
     print('Getting batched_data')
     if train_df is None:
       print('Using cached training data')
@@ -1150,19 +1766,20 @@ class TemporalFusionTransformer(object):
 
     self.model.fit(
         x=data,
-        y=np.concatenate([labels, labels, labels], axis=-1),
+        y=labels,
         sample_weight=active_flags,
         epochs=self.num_epochs,
         batch_size=self.minibatch_size,
-        validation_data=(val_data,
-                         np.concatenate([val_labels, val_labels, val_labels],
-                                        axis=-1), val_flags),
+        validation_data=(val_data, val_labels, val_flags),
         callbacks=all_callbacks,
         shuffle=True,
         use_multiprocessing=True,
         workers=self.n_multiprocessing_workers)
 
-    # Load best checkpoint again
+    self._load_best_checkpoint()
+
+  def _load_best_checkpoint(self):
+    """Reloads the best Keras checkpoint saved during training."""
     tmp_checkpont = self.get_keras_saved_path(self._temp_folder)
     if os.path.exists(tmp_checkpont):
       self.load(
@@ -1195,7 +1812,7 @@ class TemporalFusionTransformer(object):
 
     metric_values = self.model.evaluate(
         x=inputs,
-        y=np.concatenate([outputs, outputs, outputs], axis=-1),
+        y=outputs,
         sample_weight=active_entries,
         workers=16,
         use_multiprocessing=True)
@@ -1204,63 +1821,210 @@ class TemporalFusionTransformer(object):
 
     return metrics[eval_metric]
 
-  def predict(self, df, return_targets=False):
+  def predict(self, df, return_targets=False, long_format=False):
     """Computes predictions for a given input dataset.
 
     Args:
       df: Input dataframe
       return_targets: Whether to also return outputs aligned with predictions to
         faciliate evaluation
+      long_format: Whether to return a single long-format dataframe for all
+        quantiles instead
 
     Returns:
-      Input dataframe or tuple of (input dataframe, algined output dataframe).
+      Dictionary of dataframes for each quantile -- keyed by percentile, e.g.
+      'p50' -- and for targets if requested. Forecasts are in columns 't+{h}'
+      for single targets, or '{target}_t+{h}' for multiple targets.
+
+      In long format, a dataframe with one row per forecast horizon (and target
+      for multiple targets), and one column per quantile key.
     """
 
     data = self._batch_data(df)
 
-    inputs = data['inputs']
-    time = data['time']
-    identifier = data['identifier']
-    outputs = data['outputs']
-
     combined = self.model.predict(
-        inputs,
+        data['inputs'],
         workers=16,
         use_multiprocessing=True,
         batch_size=self.minibatch_size)
 
-    # Format output_csv
-    if self.output_size != 1:
-      raise NotImplementedError('Current version only supports 1D targets!')
+    return self._format_predictions(combined, data, return_targets,
+                                    long_format)
+
+  def _format_predictions(self,
+                          combined,
+                          data,
+                          return_targets=False,
+                          long_format=False):
+    """Formats model outputs into dataframes of predictions.
+
+    Args:
+      combined: Model outputs for batched data
+      data: Batched data, as returned by _batch_data
+      return_targets: Whether to also return aligned targets
+      long_format: Whether to return a single long-format dataframe
+
+    Returns:
+      Dictionary of dataframes or long-format dataframe, as returned by
+      predict.
+    """
+
+    outputs = data['outputs']
+
+    num_horizons = self.time_steps - self.num_encoder_steps
+    keys = ['p{:g}'.format(q * 100) for q in self.quantiles]
+
+    # Shape=(samples, horizon, quantiles, outputs), with targets appended as
+    # an extra quantile if relevant
+    predictions = combined.reshape(-1, num_horizons, len(self.quantiles),
+                                   self.output_size)
+    if return_targets:
+      predictions = np.concatenate(
+          [predictions, outputs[:, :, np.newaxis, :]], axis=2)
+      keys.append('targets')
+
+    forecast_time = data['time'][data['window_start'] +
+                                 self.num_encoder_steps - 1]
+    identifiers = data['identifier_lookup'][data['identifier']]
+
+    if long_format:
+      return self._format_long_predictions(predictions, keys, forecast_time,
+                                           identifiers)
+
+    # Shape=(keys, samples, outputs * horizon), grouping horizons by output
+    predictions = predictions.transpose(2, 0, 3, 1).reshape(
+        len(keys), len(predictions), -1)
+
+    if self.output_size == 1:
+      cols = ['t+{}'.format(i) for i in range(num_horizons)]
+    else:
+      cols = [
+          '{}_t+{}'.format(target, i)
+          for target in self._get_target_cols()
+          for i in range(num_horizons)
+      ]
 
     def format_outputs(prediction):
       """Returns formatted dataframes for prediction."""
 
-      flat_prediction = pd.DataFrame(
-          prediction[:, :, 0],
-          columns=[
-              't+{}'.format(i)
-              for i in range(self.time_steps - self.num_encoder_steps)
-          ])
-      cols = list(flat_prediction.columns)
-      flat_prediction['forecast_time'] = time[:, self.num_encoder_steps - 1, 0]
-      flat_prediction['identifier'] = identifier[:, 0, 0]
-
-      # Arrange in order
-      return flat_prediction[['forecast_time', 'identifier'] + cols]
-
-    # Extract predictions for each quantile into different entries
-    process_map = {
-        'p{}'.format(int(q * 100)):
-        combined[Ellipsis, i * self.output_size:(i + 1) * self.output_size]
-        for i, q in enumerate(self.quantiles)
-    }
+      flat_prediction = pd.DataFrame(prediction, columns=cols)
+      flat_prediction.insert(0, 'identifier', identifiers)
+      flat_prediction.insert(0, 'forecast_time', forecast_time)
 
-    if return_targets:
-      # Add targets if relevant
-      process_map['targets'] = outputs
+      return flat_prediction
+
+    return {k: format_outputs(predictions[i]) for i, k in enumerate(keys)}
+
+  def _format_long_predictions(self, predictions, keys, forecast_time,
+                               identifiers):
+    """Returns a long-format dataframe of predictions.
+
+    Args:
+      predictions: Array of shape=(samples, horizon, keys, outputs)
+      keys: Column names for each entry along the keys axis
+      forecast_time: Forecast time of each sample
+      identifiers: Entity identifier of each sample
+
+    Returns:
+      Dataframe with one row per sample, output and horizon.
+    """
+
+    num_samples, num_horizons, _, num_outputs = predictions.shape
+    rows_per_sample = num_outputs * num_horizons
+
+    # Shape=(samples * outputs * horizon, keys)
+    values = predictions.transpose(0, 3, 1, 2).reshape(-1, len(keys))
+
+    flat_prediction = pd.DataFrame(values, columns=keys)
+    flat_prediction.insert(0, 'horizon',
+                           np.tile(np.arange(num_horizons), num_samples *
+                                   num_outputs))
+    if num_outputs > 1:
+      flat_prediction.insert(
+          0, 'target',
+          pd.Categorical.from_codes(
+              np.tile(np.repeat(np.arange(num_outputs), num_horizons),
+                      num_samples), self._get_target_cols()))
+    flat_prediction.insert(0, 'identifier',
+                           np.repeat(identifiers, rows_per_sample))
+    flat_prediction.insert(0, 'forecast_time',
+                           np.repeat(forecast_time, rows_per_sample))
+
+    return flat_prediction
+
+  def _get_window_times(self, data, batch=slice(None)):
+    """Returns time index of each step for windows of batched data.
+
+    Args:
+      data: Batched data, as returned by _batch_data
+      batch: Slice of windows to return
+
+    Returns:
+      Array of shape=(?, self.time_steps).
+    """
+    return utils.sliding_windows(data['time'], self.time_steps,
+                                 data['window_start'][batch])
+
+  def _get_attention_batches(self, data, fetches=None):
+    """Yields attention weights for each minibatch of batched data.
+
+    All attention components are fetched together, so each minibatch needs a
+    single forward pass.
 
-    return {k: format_outputs(process_map[k]) for k in process_map}
+    Args:
+      data: Batched data, as returned by _batch_data
+      fetches: Dictionary of tensors to evaluate, defaulting to the attention
+        components
+
+    Yields:
+      Tuple of (slice of samples in batch, dictionary of attention weights).
+    """
+
+    session = tf.compat.v1.keras.backend.get_session()
+    inputs = data['inputs']
+    if fetches is None:
+      fetches = self._attention_components
+
+    for start in range(0, len(inputs), self.minibatch_size):
+      batch = slice(start, start + self.minibatch_size)
+      yield batch, session.run(
+          fetches,
+          {self._input_placeholder: np.asarray(inputs[batch], np.float32)})
+
+  def _collect_attention(self, data, allocate, fetches=None):
+    """Collects attention weights for all samples into preallocated arrays.
+
+    Args:
+      data: Batched data, as returned by _batch_data
+      allocate: Function of (name, shape, dtype) returning the array to fill
+      fetches: Dictionary of tensors to evaluate, defaulting to the attention
+        components
+
+    Returns:
+      Dictionary of attention weights, along with their identifiers and time
+      indices.
+    """
+
+    num_samples = len(data['inputs'])
+    attention_weights = {}
+    for batch, batch_weights in self._get_attention_batches(data, fetches):
+      for k in batch_weights:
+        # Temporal attention weights are stacked by head along the first axis
+        batch_axis = 1 if batch_weights[k].ndim == 4 else 0
+        index = (slice(None),) * batch_axis + (batch,)
+
+        if k not in attention_weights:
+          shape = list(batch_weights[k].shape)
+          shape[batch_axis] = num_samples
+          attention_weights[k] = allocate(k, tuple(shape),
+                                          batch_weights[k].dtype)
+        attention_weights[k][index] = batch_weights[k]
+
+    attention_weights['identifiers'] = data['identifier_lookup'][
+        data['identifier']]
+    attention_weights['time'] = self._get_window_times(data)
+
+    return attention_weights
 
   def get_attention(self, df):
     """Computes TFT attention weights for a given dataset.
@@ -1274,57 +2038,99 @@ class TemporalFusionTransformer(object):
     """
 
     data = self._batch_data(df)
-    inputs = data['inputs']
-    identifiers = data['identifier']
-    time = data['time']
-
-    def get_batch_attention_weights(input_batch):
-      """Returns weights for a given minibatch of data."""
-      input_placeholder = self._input_placeholder
-      attention_weights = {}
-      for k in self._attention_components:
-        attention_weight = tf.compat.v1.keras.backend.get_session().run(
-            self._attention_components[k],
-            {input_placeholder: input_batch.astype(np.float32)})
-        attention_weights[k] = attention_weight
-      return attention_weights
-
-    # Compute number of batches
-    batch_size = self.minibatch_size
-    n = inputs.shape[0]
-    num_batches = n // batch_size
-    if n - (num_batches * batch_size) > 0:
-      num_batches += 1
-
-    # Split up inputs into batches
-    batched_inputs = [
-        inputs[i * batch_size:(i + 1) * batch_size, Ellipsis]
-        for i in range(num_batches)
-    ]
 
-    # Get attention weights, while avoiding large memory increases
-    attention_by_batch = [
-        get_batch_attention_weights(batch) for batch in batched_inputs
-    ]
-    attention_weights = {}
-    for k in self._attention_components:
-      attention_weights[k] = []
-      for batch_weights in attention_by_batch:
-        attention_weights[k].append(batch_weights[k])
+    return self._collect_attention(
+        data, lambda name, shape, dtype: np.empty(shape, dtype=dtype))
 
-      if len(attention_weights[k][0].shape) == 4:
-        tmp = np.concatenate(attention_weights[k], axis=1)
-      else:
-        tmp = np.concatenate(attention_weights[k], axis=0)
+  def predict_with_attention(self, df, return_targets=False, long_format=False):
+    """Computes predictions and attention weights in a single pass.
+
+    Equivalent to calling predict and get_attention, but the data is only
+    batched once and the graph evaluated once per minibatch.
 
-      del attention_weights[k]
-      gc.collect()
-      attention_weights[k] = tmp
+    Args:
+      df: Input dataframe
+      return_targets: Whether to also return outputs aligned with predictions to
+        faciliate evaluation
+      long_format: Whether to return predictions as a single long-format
+        dataframe
 
-    attention_weights['identifiers'] = identifiers[:, 0, 0]
-    attention_weights['time'] = time[:, :, 0]
+    Returns:
+      Tuple of (predictions as for predict, dictionary of attention weights as
+      for get_attention).
+    """
 
-    return attention_weights
+    data = self._batch_data(df)
+
+    fetches = dict(self._attention_components)
+    fetches['predictions'] = self.model.output
+    attention_weights = self._collect_attention(
+        data, lambda name, shape, dtype: np.empty(shape, dtype=dtype),
+        fetches)
+
+    predictions = self._format_predictions(
+        attention_weights.pop('predictions'), data, return_targets,
+        long_format)
+
+    return predictions, attention_weights
+
+  def iterate_attention(self, df):
+    """Computes TFT attention weights for a given dataset batch by batch.
+
+    Streaming version of get_attention, for datasets whose attention weights
+    do not fit in memory.
+
+    Args:
+      df: Input dataframe
+
+    Yields:
+      Dictionary of numpy arrays for the attention weights of each minibatch,
+        along with their identifiers and time indices
+    """
+
+    data = self._batch_data(df)
+
+    for batch, attention_weights in self._get_attention_batches(data):
+      attention_weights['identifiers'] = data['identifier_lookup'][
+          data['identifier'][batch]]
+      attention_weights['time'] = self._get_window_times(data, batch)
+      yield attention_weights
+
+  def save_attention(self, df, output_folder):
+    """Computes TFT attention weights for a given dataset and saves to disk.
+
+    Weights are written batch by batch into memory-mapped .npy files named
+    after each attention component, so that only one minibatch of weights is
+    held in memory at a time.
+
+    Args:
+      df: Input dataframe
+      output_folder: Folder to save attention weights
+
+    Returns:
+      Dictionary of file paths for each saved array.
+    """
+
+    utils.create_folder_if_not_exist(output_folder)
+    data = self._batch_data(df)
+
+    def get_path(name):
+      return os.path.join(output_folder, '{}.npy'.format(name))
+
+    def allocate(name, shape, dtype):
+      return np.lib.format.open_memmap(
+          get_path(name), mode='w+', dtype=dtype, shape=shape)
+
+    attention_weights = self._collect_attention(data, allocate)
+    for k in attention_weights:
+      if isinstance(attention_weights[k], np.memmap):
+        attention_weights[k].flush()
+      else:
+        np.save(get_path(k), attention_weights[k])
+
+    print('Attention weights saved to: {}'.format(output_folder))
+
+    return {k: get_path(k) for k in attention_weights}
 
   # Serialisation.
   def reset_temp_folder(self):
@@ -60,6 +60,134 @@ def extract_cols_from_data_type(data_type, column_definition,
   ]
 
 
+# Windowing functions.
+def get_entity_offsets(entity_ids):
+  """Returns the offset table of contiguous entity blocks in a flat array.
+
+  Args:
+    entity_ids: Array of entity identifiers, with rows of the same entity
+      stored contiguously
+
+  Returns:
+    Tuple of int64 arrays for: (start row of each entity, number of rows of
+    each entity)
+  """
+  num_rows = len(entity_ids)
+  if num_rows == 0:
+    return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+  entity_ids = np.asarray(entity_ids)
+  boundaries = np.flatnonzero(entity_ids[1:] != entity_ids[:-1]) + 1
+  starts = np.concatenate([[0], boundaries]).astype(np.int64)
+  lengths = np.diff(np.concatenate([starts, [num_rows]])).astype(np.int64)
+
+  return starts, lengths
+
+
+def get_num_windows(entity_lengths, window_size):
+  """Returns number of complete windows available in each entity.
+
+  Args:
+    entity_lengths: Number of rows per entity
+    window_size: Number of time steps per window
+  """
+  return np.maximum(entity_lengths - window_size + 1, 0)
+
+
+def get_window_starts(entity_starts, num_windows, window_indices):
+  """Maps flat window indices onto start rows using an entity offset table.
+
+  Windows are numbered consecutively across entities, so that index i refers
+  to the i-th valid window of the table as a whole.
+
+  Args:
+    entity_starts: Start row of each entity
+    num_windows: Number of valid windows of each entity
+    window_indices: Flat indices of windows to locate
+
+  Returns:
+    Int64 array of row indices at which the requested windows start.
+  """
+  window_ends = np.cumsum(num_windows)
+  entity = np.searchsorted(window_ends, window_indices, side='right')
+  first_window = window_ends - num_windows
+
+  return entity_starts[entity] + window_indices - first_window[entity]
+
+
+def get_valid_window_starts(entity_ids, window_size):
+  """Returns start rows of all windows that lie entirely within one entity.
+
+  Args:
+    entity_ids: Array of entity identifiers, with rows of the same entity
+      stored contiguously
+    window_size: Number of time steps per window
+
+  Returns:
+    Sorted int64 array of row indices at which valid windows start.
+  """
+  starts, lengths = get_entity_offsets(entity_ids)
+  num_windows = get_num_windows(lengths, window_size)
+
+  return get_window_starts(starts, num_windows,
+                           np.arange(num_windows.sum(), dtype=np.int64))
+
+
+def get_shard_boundaries(keys, num_shards):
+  """Splits rows into contiguous shards of similar size.
+
+  Shard boundaries are only placed where keys change, so that runs of equal
+  keys -- e.g. windows of one entity -- are never split across shards.
+
+  Args:
+    keys: Array of keys for each row
+    num_shards: Maximum number of shards
+
+  Returns:
+    Sorted int64 array of boundaries, from 0 to the number of rows, with shard
+    i covering rows [boundaries[i], boundaries[i + 1]).
+  """
+  run_starts, _ = get_entity_offsets(keys)
+  candidates = np.concatenate([run_starts, [len(keys)]]).astype(np.int64)
+
+  # Rounds even split points up to the start of the next run
+  targets = np.linspace(0, len(keys), num_shards + 1)
+  boundaries = candidates[np.searchsorted(candidates, targets)]
+
+  return np.unique(boundaries)
+
+
+def sliding_windows(x, window_size, start_indices=None, copy=False):
+  """Returns sliding windows over the first axis of an array.
+
+  Windows are strided views into x, so data is only materialised when
+  start_indices are used to gather a subset of windows or copy is set.
+
+  Args:
+    x: Array to window, with time along the first axis
+    window_size: Number of time steps per window
+    start_indices: Optional row indices at which windows should start
+    copy: Whether to return a copy when no start_indices are given
+
+  Returns:
+    Array of shape=(num_windows, window_size) + x.shape[1:].
+  """
+  if len(x) < window_size:
+    num_windows = 0 if start_indices is None else len(start_indices)
+    if num_windows > 0:
+      raise ValueError('Window size={} exceeds data length={}'.format(
+          window_size, len(x)))
+    return np.zeros((0, window_size) + x.shape[1:], dtype=x.dtype)
+
+  windows = np.lib.stride_tricks.sliding_window_view(x, window_size, axis=0)
+  windows = np.moveaxis(windows, -1, 1)  # move window axis next to samples
+
+  if start_indices is not None:
+    return windows[start_indices]
+
+  return windows.copy() if copy else windows
+
+
 # Loss functions.
 def tensorflow_quantile_loss(y, y_pred, quantile):
   """Computes quantile loss for tensorflow.
@@ -89,6 +217,43 @@ def tensorflow_quantile_loss(y, y_pred, quantile):
   return tf.reduce_sum(q_loss, axis=-1)
 
 
+def tensorflow_multi_quantile_loss(y, y_pred, quantiles):
+  """Computes quantile loss over several quantiles at once for tensorflow.
+
+  Vectorised version of tensorflow_quantile_loss, which broadcasts a vector of
+  quantiles against a single target tensor -- so targets need not be repeated
+  for each quantile.
+
+  Args:
+    y: Targets of shape=(..., output_size)
+    y_pred: Predictions of shape=(..., len(quantiles) * output_size), with one
+      block of output_size entries per quantile
+    quantiles: Quantiles to use for loss calculations (between 0 & 1)
+
+  Returns:
+    Tensor for quantile loss, summed over quantiles and outputs.
+  """
+
+  # Checks quantiles
+  quantiles = np.asarray(quantiles, dtype=np.float32)
+  if np.any(quantiles < 0) or np.any(quantiles > 1):
+    raise ValueError(
+        'Illegal quantile values={}! Values should be between 0 and 1.'.format(
+            list(quantiles)))
+
+  # Shape=(..., quantiles, output_size)
+  y_pred = tf.reshape(
+      y_pred,
+      tf.concat([tf.shape(y_pred)[:-1], [len(quantiles), -1]], axis=0))
+  quantiles = quantiles[:, np.newaxis]
+
+  prediction_underflow = tf.expand_dims(y, axis=-2) - y_pred
+  q_loss = quantiles * tf.maximum(prediction_underflow, 0.) + (
+      1. - quantiles) * tf.maximum(-prediction_underflow, 0.)
+
+  return tf.reduce_sum(q_loss, axis=[-2, -1])
+
+
 def numpy_normalised_quantile_loss(y, y_pred, quantile):
   """Computes normalised quantile loss for numpy arrays.
 
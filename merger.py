@@ -7,15 +7,18 @@
     Usage:
     python merger.py region
     python merger.py region1 region2 ...
+    python merger.py -j 4 region1 region2 ...   (merge regions on 4 processes)
 
     Output:
     ./csv_data/final.csv
 """
 import sys
+import multiprocessing
 import pandas as pd
-import datetime
+from libs.preprocessing import energy_process
 import time
 args = sys.argv
+data_path = './' + 'csv_data' + '/'
 
 def debug(df, path):
     """
@@ -81,20 +84,39 @@ def obs_process(df, region):
     return(output)
 
 
-def energy_process(df):
+def merge_region(x):
     """
-        energy data processing
-        converts 24:00:00 into normal form
+        merges obs + fcst + energy data of a single region
+        returns one dataframe per plant, in energy.csv column order
     """
-    output = df.copy()
-    output['date'] = output['time'].apply(lambda x: x.split()[0])
-    output['time'] = output['time'].apply(lambda x: x.split()[1])
-    output['time'] = output['time'].str.rjust(8, '0')
-    output.loc[output['time'] == '24:00:00', 'time'] = '00:00:00'
-    output['time'] = output['date'] + ' ' + output['time']
-    output['time'] = pd.to_datetime(output['time'])
-    output.loc[output['time'].dt.hour == 0, 'time'] += datetime.timedelta(days=1)
-    return(output)
+    region_df_set = []
+    energy_columns = pd.read_csv(data_path + 'energy.csv', nrows=0).columns
+    plants = [col_mem for col_mem in energy_columns if x in col_mem]
+    energy = pd.read_csv(data_path + 'energy.csv', usecols=['time'] + plants)
+    energy = energy_process(energy)
+
+    obs_csv_path = data_path + x + '_obs_data.csv'
+    fcst_csv_path = data_path + x + '_fcst_data.csv'
+    df_fcst = pd.read_csv(fcst_csv_path)
+    df_fcst = fcst_process(df_fcst, x)
+    df_obs = pd.read_csv(obs_csv_path)
+    df_obs = obs_process(df_obs, x)
+
+    # merging obs + fcst + energy = region_df
+    temp = pd.merge(df_obs, df_fcst, how='outer', on='time')
+    temp_reindex = temp.sort_values(by=['time', 'fcst_fcst'], axis=0)
+    temp_reindex_dropped = temp_reindex.drop(columns=["forecast"], inplace=False)
+    temp_duplicated = temp_reindex_dropped.drop_duplicates(subset='time', keep='last', inplace=False)
+    temp_duplicated_dropped = temp_duplicated.drop(columns=["fcst_fcst"], inplace=False)
+    temp_duplicated_dropped.dropna(subset=['region'], how='any', axis=0, inplace=True)
+    for col_mem in plants:
+        temp1 = temp_duplicated_dropped.copy()
+        temp1.reset_index(inplace=True)
+        temp1['energy'] = energy[col_mem]
+        temp1.insert(1, 'ID', col_mem)
+        region_df_set.append(temp1)
+    print('Processing Done. (region: ' + x + ')')
+    return(region_df_set)
 
 
 if __name__ == '__main__':
@@ -102,51 +124,27 @@ if __name__ == '__main__':
     Args:
         region: array for region data ([0]: first arg, [1]: second arg)
         region_df_set: array for processed multiple regions' dataframe
-        data_path: file folder to load and save .csv files(TODO: set by arguments?)
+        num_workers: number of processes to merge regions with (-j option)
     """
-    region = []
+    region = args[1:]
     region_df_set = []
-    if len(args) == 1:
+    num_workers = 1
+    if len(region) >= 2 and region[0] == '-j':
+        num_workers = int(region[1])
+        region = region[2:]
+    if len(region) == 0:
         exit()
     else:
-        first_pass = 1  # ignore program's first argument
-        data_path = './' + 'csv_data' + '/'
-        energy = pd.read_csv(data_path + 'energy.csv')
-        energy = energy_process(energy)
-
         # process each region's data file
-        for x in args:
-            if first_pass == 1:
-                first_pass = 0
-            else:
-                obs_csv_path = data_path + x + '_obs_data.csv'
-                fcst_csv_path = data_path + x + '_fcst_data.csv'
-                df_fcst = pd.read_csv(fcst_csv_path)
-                df_fcst = fcst_process(df_fcst, x)
-                df_obs = pd.read_csv(obs_csv_path)
-                df_obs = obs_process(df_obs, x)
-                region.append(x + '_')
-
-                # merging obs + fcst + energy = region_df
-                temp = pd.merge(df_obs, df_fcst, how='outer', on='time')
-                temp_reindex = temp.sort_values(by=['time', 'fcst_fcst'], axis=0)
-                temp_reindex_dropped = temp_reindex.drop(columns=["forecast"], inplace=False)
-                temp_duplicated = temp_reindex_dropped.drop_duplicates(subset='time', keep='last', inplace=False)
-                temp_duplicated_dropped = temp_duplicated.drop(columns=["fcst_fcst"], inplace=False)
-                temp_duplicated_dropped.dropna(subset=['region'], how='any', axis=0, inplace=True)
-                for col_mem in energy.columns:
-                    if x in col_mem:
-                        temp1 = temp_duplicated_dropped.copy()
-                        temp1.reset_index(inplace=True)
-                        temp1['energy'] = energy[col_mem]
-                        # debug_e = pd.DataFrame(energy[col_mem], columns=[col_mem])
-                        # debug(debug_e, col_mem + 'one')
-                        # debug(temp1, col_mem + 'temp')
-                        temp1.insert(1, 'ID', col_mem)
-                        region_df_set.append(temp1)
-                    else:
-                        continue
-                print('Processing Done. (region: ' + x + ')')
+        # results are gathered in argument order, so the output does not
+        # depend on which worker finishes first
+        if num_workers > 1 and len(region) > 1:
+            with multiprocessing.Pool(min(num_workers, len(region))) as pool:
+                region_dfs = pool.map(merge_region, region)
+        else:
+            region_dfs = [merge_region(x) for x in region]
+        for x in region_dfs:
+            region_df_set.extend(x)
 
         # combining region dataframes
         df_combined = pd.concat(region_df_set, ignore_index=True)
@@ -34,7 +34,11 @@ set -e
 pip3 install virtualenv # Assumes pip3 is installed!
 python3 -m virtualenv $OUTPUT_FOLDER/venv
 source $OUTPUT_FOLDER/venv/bin/activate
-pip3 install --pre "tensorflow==1.15.*"
+# TF 2.7 is the first release compatible with numpy>=1.20, and TF 2.16
+# moves to Keras 3, which drops the tf.compat.v1.keras layers used by the TFT.
+# From TF 2.11 on, the TFT trains with tf.keras.optimizers.legacy.Adam, as the
+# new Keras optimizers cannot be used by graph-mode training.
+pip3 install "tensorflow>=2.7,<2.16"
 pip3 install -r requirements.txt
 
 # Step 2: Downloads data if not present.
@@ -23,11 +23,15 @@ dataset-specific processing.
 
 Usage:
   python3 script_download_data {EXPT_NAME} {OUTPUT_FOLDER} {FORCE_DOWNLOAD}
+    {DATA_FORMAT} {NUM_WORKERS}
 
 Command line args:
   EXPT_NAME: Name of experiment to download data for  {e.g. volatility}
   OUTPUT_FOLDER: Path to folder in which
-  FORCE_DOWNLOAD: Whether to force data download from scratch.
+  FORCE_DOWNLOAD: Whether to force data download from scratch, or 'append' to
+    add only new rows to previously processed data.
+  DATA_FORMAT: File format for processed data, either csv or parquet.
+  NUM_WORKERS: Number of processes used to merge regions in parallel.
 
 
 
@@ -39,16 +43,19 @@ from __future__ import print_function
 
 import argparse
 
+import functools
 import gc
 import glob
+import multiprocessing
 import os
 import shutil
 import sys
 
 from expt_settings.configs import ExperimentConfig
+from expt_settings.configs import DataFileWriter
+from libs.preprocessing import energy_process
 import numpy as np
 import pandas as pd
-import datetime
 import pyunpack
 import wget
 
@@ -128,69 +135,138 @@ def obs_process(df, region):
     return(output)
 
 
-def energy_process(df):
+def merge_region(region, since=None):
     """
-        energy data processing
-        converts 24:00:00 into normal form
+        merges obs and fcst data of a single region
+        keeps only the latest forecast for each time
+        only times after since are merged, if given
     """
-    output = df.copy()
-    output['date'] = output['time'].apply(lambda x: x.split()[0])
-    output['time'] = output['time'].apply(lambda x: x.split()[1])
-    output['time'] = output['time'].str.rjust(8, '0')
-    output.loc[output['time'] == '24:00:00', 'time'] = '00:00:00'
-    output['time'] = output['date'] + ' ' + output['time']
-    output['time'] = pd.to_datetime(output['time'])
-    output.loc[output['time'].dt.hour == 0, 'time'] += datetime.timedelta(days=1)
+    obs_csv_path = data_path + region + '_obs_data.csv'
+    fcst_csv_path = data_path + region + '_fcst_data.csv'
+    df_fcst = pd.read_csv(fcst_csv_path)
+    df_obs = pd.read_csv(obs_csv_path)
+    if since is not None:
+        # drop processed rows first, so only new rows are processed
+        fcst_time = pd.to_datetime(df_fcst['Forecast time']) + pd.to_timedelta(df_fcst['forecast'], 'h')
+        df_fcst = df_fcst[fcst_time > since]
+        df_obs = df_obs[pd.to_datetime(df_obs['일시']) > since]
+    df_fcst = fcst_process(df_fcst, region)
+    df_obs = obs_process(df_obs, region)
+
+    temp = pd.merge(df_obs, df_fcst, how='outer', on='time')
+    temp_reindex = temp.sort_values(by=['time', 'fcst_fcst'], axis=0)
+    temp_reindex_dropped = temp_reindex.drop(columns=["forecast"], inplace=False)
+    temp_duplicated = temp_reindex_dropped.drop_duplicates(subset='time', keep='last', inplace=False)
+    temp_duplicated_dropped = temp_duplicated.drop(columns=["fcst_fcst"], inplace=False)
+    temp_duplicated_dropped.dropna(subset=['region'], how='any', axis=0, inplace=True)
+    return(temp_duplicated_dropped)
+
+
+def get_region_plants(region):
+    """
+        returns energy columns (plants) belonging to region
+    """
+    energy_columns = pd.read_csv(data_path + 'energy.csv', nrows=0).columns
+    return([col_mem for col_mem in energy_columns if region in col_mem])
+
+
+def merge_plant(region_df, energy, plant):
+    """
+        adds energy values of a single plant to its region dataframe
+    """
+    output = region_df.copy()
+    output.reset_index(inplace=True)
+    output['energy'] = energy[plant]
+    output.insert(1, 'ID', plant)
     return(output)
 
 
-def merger():
+def load_plant_energy(plants, skip_rows=0):
     """
-    Args:
-        region: array for region info
-        region_df_set: array for multiple region dataframe
+        reads and processes energy data of the given plants only
+        the first skip_rows rows are skipped without being processed
     """
-    region = []
-    region_df_set = []
-    energy = pd.read_csv(data_path + 'energy.csv')
+    energy = pd.read_csv(data_path + 'energy.csv', usecols=['time'] + plants,
+                         skiprows=range(1, skip_rows + 1))
     energy = energy_process(energy)
+    # keep dtypes consistent across plants, as in the fully merged frame
+    energy[plants] = energy[plants].astype('float64')
+    return(energy)
+
+
+def get_processed_plants(state):
+    """
+        returns {plant: (last time, # of rows)} from the state of a data file writer
+    """
+    plants = state.get('plants', {})
+    return({plant: (pd.Timestamp(last_time), num_rows) for plant, (last_time, num_rows) in plants.items()})
+
+
+def update_processed_plants(state, plant_df):
+    """
+        records the last time and # of rows of a written plant in the writer state
+    """
+    plants = state.setdefault('plants', {})
+    plant = plant_df['ID'].iloc[0]
+    _, num_rows = plants.get(plant, (None, 0))
+    plants[plant] = [str(plant_df['date'].max()), num_rows + len(plant_df)]
+
+
+def merge_region_plants(region, processed=None):
+    """
+        merges obs, fcst and energy data of every plant in a region
+        yields (plant, dataframe) pairs in sorted plant order, merging each
+        plant only once the previous one has been consumed
 
-    # process each region's data file
-    for x in region_default:
-        obs_csv_path = data_path + x + '_obs_data.csv'
-        fcst_csv_path = data_path + x + '_fcst_data.csv'
-        df_fcst = pd.read_csv(fcst_csv_path)
-        df_fcst = fcst_process(df_fcst, x)
-        df_obs = pd.read_csv(obs_csv_path)
-        df_obs = obs_process(df_obs, x)
-        region.append(x + '_')
-
-        # merging obs + fcst + energy = region_df
-        temp = pd.merge(df_obs, df_fcst, how='outer', on='time')
-        temp_reindex = temp.sort_values(by=['time', 'fcst_fcst'], axis=0)
-        temp_reindex_dropped = temp_reindex.drop(columns=["forecast"], inplace=False)
-        temp_duplicated = temp_reindex_dropped.drop_duplicates(subset='time', keep='last', inplace=False)
-        temp_duplicated_dropped = temp_duplicated.drop(columns=["fcst_fcst"], inplace=False)
-        temp_duplicated_dropped.dropna(subset=['region'], how='any', axis=0, inplace=True)
-
-        # Add each energy value
-        for col_mem in energy.columns:
-            if x in col_mem:
-                temp1 = temp_duplicated_dropped.copy()
-                temp1.reset_index(inplace=True)
-                temp1['energy'] = energy[col_mem]
-                temp1.insert(1, 'ID', col_mem)
-                region_df_set.append(temp1)
-            else:
-                continue
-        print('Processing done. (region: ' + x + ')')
-
-    # combining region dataframes
-    df_combined = pd.concat(region_df_set, ignore_index=True)
-    ############## TODO: fill NaN within func
-    df_output = df_combined.fillna(0)
-    print('Merging done.')
-    return(df_output)
+        plants found in processed only get rows after their last processed time
+        energy rows are paired by position, as in a full merge, so they are
+        offset by the # of rows already processed
+    """
+    processed = processed or {}
+    plants = sorted(get_region_plants(region))
+    since = None
+    skip_rows = 0
+    if all(plant in processed for plant in plants):
+        since = min(processed[plant][0] for plant in plants)
+        skip_rows = min(processed[plant][1] for plant in plants)
+
+    region_df = merge_region(region, since)
+    energy = load_plant_energy(plants, skip_rows)
+    for plant in plants:
+        plant_df = region_df
+        plant_energy = energy
+        if plant in processed:
+            last_time, num_rows = processed[plant]
+            plant_df = region_df[region_df['time'] > last_time]
+            num_rows -= skip_rows
+            plant_energy = energy.iloc[num_rows:num_rows + len(plant_df)].reset_index(drop=True)
+        yield plant, merge_plant(plant_df, plant_energy, plant)
+    print('Processing done. (region: ' + region + ')')
+
+
+def collect_region(function, region):
+    """
+        returns all results of a region generator as a list, to be sent back
+        from a worker process
+    """
+    return(list(function(region)))
+
+
+def map_regions(function, regions, num_workers=1):
+    """
+        applies function to each region, fanning out over a process pool
+        results are yielded in the order of regions, whichever worker finishes first
+        with a single worker, the generator of each region is yielded as is,
+        so its results are only built as they are consumed
+    """
+    if num_workers <= 1 or len(regions) <= 1:
+        for region in regions:
+            yield function(region)
+        return
+
+    with multiprocessing.Pool(min(num_workers, len(regions))) as pool:
+        for output in pool.imap(functools.partial(collect_region, function), regions):
+            yield output
 
 
 def boundary_slice(df, col_name, boundary):
@@ -210,75 +286,55 @@ def boundary_slice(df, col_name, boundary):
     return(output)
 
 
-def boundary_selector(unselected_df):
+def select_plant_boundaries(name, group, append=False):
     """
-        DataFrame Analysis
-
-        # of Regions: 4
-        # of Dates: 1068
-        Time format : 00 ~ 23
-        # of total Datasets: 1068 * 24 * 4 = 102528
-        actual # of total Datasets = 102510
+        selects obs values before the test boundary and fcst values after it,
+        for a single plant
+        appended rows lie past the test boundary of existing data, so they
+        only use fcst values
     """
-    total_num = len(unselected_df)
     train_boundary_rate = (train_rate) / (train_rate + valid_rate + test_rate)
     valid_boundary_rate = (train_rate + valid_rate) / (train_rate + valid_rate + test_rate)
-    processed_df_set = []
-    print('valid region: ( ', end='')
-    for name, group in unselected_df.groupby('ID'):
-        print(name, end='')
-        print('(#=' + str(len(group)) + ')', end=' ')
-    print(')')
-    print('Select with rate ( test : validation : test ) = (', train_rate, ':', valid_rate, ':', test_rate, ')')
-    for name, group in unselected_df.groupby('ID'):
-        # common data type classifier
-        df = pd.DataFrame()
-        group.reset_index(inplace=True)
-        group_len = len(group)
-        df['id'] = group['ID']  # ID: plant
-        df['region'] = group['region']
-        df['date'] = pd.to_datetime(group['time'])
-        df['month'] = df['date'].dt.month
-        df['week_of_year'] = df['date'].dt.isocalendar().week
-        df['day_of_month'] = df['date'].dt.day
-        df['days_from_start'] = (df['date'] - pd.to_datetime('2018-03-01 00:00')).dt.days
-
-        # boundary data type classifier
+
+    # common data type classifier
+    df = pd.DataFrame()
+    group = group.reset_index()
+    group_len = len(group)
+    df['id'] = group['ID']  # ID: plant
+    df['region'] = group['region']
+    df['date'] = pd.to_datetime(group['time'])
+    df['month'] = df['date'].dt.month
+    df['week_of_year'] = df['date'].dt.isocalendar().week
+    df['day_of_month'] = df['date'].dt.day
+    df['days_from_start'] = (df['date'] - pd.to_datetime('2018-03-01 00:00')).dt.days
+
+    # boundary data type classifier
+    if append:
+        valid_boundary = 0
+        print(name + ':')
+        print('appended:', group.loc[[0, group_len - 1], :]['time'].values, '(#=', str(group_len) + ')')
+    else:
         train_boundary = round(train_boundary_rate * group_len)
         valid_boundary = round(valid_boundary_rate * group_len)
         print(name + ':')
         print('train boundary:', group.loc[[train_boundary], :]['time'].values, '(#=', str(train_boundary) + ')')
         print('valid boundary:', group.loc[[valid_boundary], :]['time'].values, '(#=', str(valid_boundary - train_boundary) + ')')
         print('test boundary:', group.loc[[group_len - 1], :]['time'].values, '(#=', str(group_len - valid_boundary) + ')')
-        df['temperature'] = boundary_slice(group, 'temp', valid_boundary)
-        df['wind_speed'] = boundary_slice(group, 'windSpd', valid_boundary)
-        df['wind_direction'] = boundary_slice(group, 'windDir', valid_boundary)
-        df['humidity'] = boundary_slice(group, 'humid', valid_boundary)
-        df['cloud'] = boundary_slice(group, 'cloud', valid_boundary)
+    df['temperature'] = boundary_slice(group, 'temp', valid_boundary)
+    df['wind_speed'] = boundary_slice(group, 'windSpd', valid_boundary)
+    df['wind_direction'] = boundary_slice(group, 'windDir', valid_boundary)
+    df['humidity'] = boundary_slice(group, 'humid', valid_boundary)
+    df['cloud'] = boundary_slice(group, 'cloud', valid_boundary)
 
-        # copy energy values
-        df['energy'] = group['energy']
+    # copy energy values
+    df['energy'] = group['energy']
+    return(df)
 
-        processed_df_set.append(df)
-    processed_df = pd.concat(processed_df_set, ignore_index=True)
-    print('Selection done.')
-    return(processed_df)
 
-
-# Dataset specific download routines.
-def process_dacon(config):
+def format_dacon(df_selected):
     """
-        Processing dacon data files
+        makes new DataFrame for model input
     """
-    data_folder = config.data_folder
-
-    print("Merging into one...")
-    df_merged = merger()
-    print("Selecting boundaries")
-    df_selected = boundary_selector(df_merged)
-    print("Adding more informations...")
-
-    # make new DataFrame for model input
     df = pd.DataFrame()
     df['ID'] = df_selected['id']
     df['date'] = pd.to_datetime(df_selected['date'])
@@ -293,29 +349,82 @@ def process_dacon(config):
     df['energy'] = df_selected['energy']
     df['Region'] = df_selected['region']
     df['days_from_start'] = df_selected['days_from_start']
+    return(df)
+
+
+# Dataset specific download routines.
+def process_region(region, processed=None):
+    """
+        merges, boundary-selects and formats every plant in a region
+        yields one formatted dataframe per plant
+        plants found in processed only get their new rows
+    """
+    processed = processed or {}
+    for plant, plant_df in merge_region_plants(region, processed):
+        plant_df = plant_df.fillna(0)
+        print('Processing plant: ' + plant + ' (#=' + str(len(plant_df)) + ')')
+        if len(plant_df) == 0:
+            continue
+        yield format_dacon(select_plant_boundaries(plant, plant_df, plant in processed))
+
+
+def process_dacon(config, num_workers=1, append=False):
+    """
+        Processing dacon data files
 
+        Each plant is merged, boundary-selected and formatted on its own, then
+        appended to the output file before the next plant is built, so peak
+        memory is bounded by the source data of one region and a single plant.
+        With several workers, each worker returns the plants of a whole
+        region instead. Regions are written in sorted order regardless of
+        num_workers, so the output file is identical for any pool size.
+
+        With append, only rows after the last processed time of each plant are
+        merged and added to the end of an existing output file. Last times and
+        row counts are kept in the state file of the output, so existing data
+        is never read back.
+    """
     output_file = config.data_csv_path
-    print('Completed formatting, saving to {}'.format(output_file))
-    df.to_csv(output_file)
+    writer = DataFileWriter(output_file, append=append)
+    processed = get_processed_plants(writer.state)
+    if processed:
+        print('Appending to {} (#={})'.format(output_file, writer.num_rows))
+
+    print('Select with rate ( test : validation : test ) = (', train_rate, ':', valid_rate, ':', test_rate, ')')
+    function = functools.partial(process_region, processed=processed)
+    for plant_dfs in map_regions(function, sorted(region_default), num_workers):
+        for plant_df in plant_dfs:
+            writer.write(plant_df)
+            update_processed_plants(writer.state, plant_df)
+
+    writer.close()
+    print('Completed formatting, saved to {}'.format(output_file))
 
     print('Done.')
 
 
 # Core routine.
-def main(expt_name, force_download, output_folder):
+def main(expt_name, force_download, output_folder, data_format=None,
+         num_workers=1, append=False):
   """Runs main download routine.
 
   Args:
     expt_name: Name of experiment
     force_download: Whether to force data download from scratch
     output_folder: Folder path for storing data
+    data_format: File format to save processed data in, or None to keep the
+      format of existing data
+    num_workers: Number of processes used to merge regions in parallel
+    append: Whether to add only new rows to previously processed data
   """
 
   print('#### Running download script ####')
 
-  expt_config = ExperimentConfig(expt_name, output_folder)
+  expt_config = ExperimentConfig(expt_name, output_folder, data_format)
 
-  if os.path.exists(expt_config.data_csv_path) and not force_download:
+  if append:
+    print('Appending new data...')
+  elif os.path.exists(expt_config.data_csv_path) and not force_download:
     print('Data has been processed for {}. Skipping download...'.format(
         expt_name))
     sys.exit(0)
@@ -336,7 +445,7 @@ def main(expt_name, force_download, output_folder):
 
   # Run data download
   print('Getting {} data...'.format(expt_name))
-  download_function(expt_config)
+  download_function(expt_config, num_workers=num_workers, append=append)
 
   print('Download completed.')
 
@@ -368,15 +477,38 @@ if __name__ == '__main__':
         metavar='r',
         type=str,
         nargs='?',
-        choices=['yes', 'no'],
+        choices=['yes', 'no', 'append'],
         default='no',
-        help='Whether to re-run data download')
+        help='Whether to re-run data download, or append new data')
+    parser.add_argument(
+        'data_format',
+        metavar='d',
+        type=str,
+        nargs='?',
+        choices=ExperimentConfig.data_formats,
+        default=None,
+        help='File format to save processed data in. Default=parquet if '
+        'parquet data is already present, csv otherwise')
+    parser.add_argument(
+        'num_workers',
+        metavar='n',
+        type=int,
+        nargs='?',
+        default=1,
+        help='Number of processes used to merge regions in parallel')
 
     args = parser.parse_known_args()[0]
 
     root_folder = None if args.output_folder == '.' else args.output_folder
 
-    return args.expt_name, args.force_download == 'yes', root_folder
-
-  name, force, folder = get_args()
-  main(expt_name=name, force_download=force, output_folder=folder)
+    return args.expt_name, args.force_download == 'yes', root_folder, \
+        args.data_format, args.num_workers, args.force_download == 'append'
+
+  name, force, folder, data_format, num_workers, append = get_args()
+  main(
+      expt_name=name,
+      force_download=force,
+      output_folder=folder,
+      data_format=data_format,
+      num_workers=num_workers,
+      append=append)
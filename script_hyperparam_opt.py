@@ -30,7 +30,6 @@ import libs.hyperparam_opt
 import libs.tft_model
 import libs.utils as utils
 import numpy as np
-import pandas as pd
 import tensorflow.compat.v1 as tf
 
 ExperimentConfig = expt_settings.configs.ExperimentConfig
@@ -39,7 +38,7 @@ ModelClass = libs.tft_model.TemporalFusionTransformer
 
 
 def main(expt_name, use_gpu, restart_opt, model_folder, hyperparam_iterations,
-         data_csv_path, data_formatter):
+         data_csv_path, data_formatter, cache_folder=None):
   """Runs main hyperparameter optimization routine.
 
   Args:
@@ -48,9 +47,11 @@ def main(expt_name, use_gpu, restart_opt, model_folder, hyperparam_iterations,
     restart_opt: Whether to run hyperparameter optimization from scratch
     model_folder: Folder path where models are serialized
     hyperparam_iterations: Number of iterations of random search
-    data_csv_path: Path to csv file containing data
+    data_csv_path: Path to csv or parquet file containing data
     data_formatter: Dataset-specific data fromatter (see
       expt_settings.dataformatter.GenericDataFormatter)
+    cache_folder: Folder to persist batched training data across runs, or None
+      to only cache in memory
   """
 
   if not isinstance(data_formatter, data_formatters.base.GenericDataFormatter):
@@ -68,7 +69,8 @@ def main(expt_name, use_gpu, restart_opt, model_folder, hyperparam_iterations,
 
   print("### Running hyperparameter optimization for {} ###".format(expt_name))
   print("Loading & splitting data...")
-  raw_data = pd.read_csv(data_csv_path, index_col=0)
+  raw_data = expt_settings.configs.load_data(
+      data_csv_path, columns=data_formatter.get_data_columns())
   train, valid, test = data_formatter.split_data(raw_data)
   train_samples, valid_samples = data_formatter.get_num_samples_for_calibration(
   )
@@ -78,6 +80,15 @@ def main(expt_name, use_gpu, restart_opt, model_folder, hyperparam_iterations,
   param_ranges = ModelClass.get_hyperparm_choices()
   fixed_params["model_folder"] = model_folder
 
+  if cache_folder is not None:
+    libs.tft_model.TFTDataCache.enable_disk_cache(
+        cache_folder,
+        data_csv_path,
+        fixed_params["column_definition"],
+        fixed_params["total_time_steps"],
+        fixed_params["num_encoder_steps"],
+        num_samples=(train_samples, valid_samples))
+
   print("*** Loading hyperparm manager ***")
   opt_manager = HyperparamOptManager(param_ranges, fixed_params, model_folder)
 
@@ -228,4 +239,5 @@ if __name__ == "__main__":
       model_folder=os.path.join(config.model_folder, "main"),
       hyperparam_iterations=config.hyperparam_iterations,
       data_csv_path=config.data_csv_path,
-      data_formatter=formatter)
+      data_formatter=formatter,
+      cache_folder=config.cache_folder)
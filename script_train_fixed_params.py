@@ -39,7 +39,6 @@ import libs.hyperparam_opt
 import libs.tft_model
 import libs.utils as utils
 import numpy as np
-import pandas as pd
 import tensorflow.compat.v1 as tf
 
 ExperimentConfig = expt_settings.configs.ExperimentConfig
@@ -52,18 +51,21 @@ def main(expt_name,
          model_folder,
          data_csv_path,
          data_formatter,
-         use_testing_mode=False):
+         use_testing_mode=False,
+         cache_folder=None):
   """Trains tft based on defined model params.
 
   Args:
     expt_name: Name of experiment
     use_gpu: Whether to run tensorflow with GPU operations
     model_folder: Folder path where models are serialized
-    data_csv_path: Path to csv file containing data
+    data_csv_path: Path to csv or parquet file containing data
     data_formatter: Dataset-specific data fromatter (see
       expt_settings.dataformatter.GenericDataFormatter)
     use_testing_mode: Uses a smaller models and data sizes for testing purposes
       only -- switch to False to use original default settings
+    cache_folder: Folder to persist batched training data across runs, or None
+      to only cache in memory
   """
 
   num_repeats = 1
@@ -85,7 +87,8 @@ def main(expt_name,
   print("*** Training from defined parameters for {} ***".format(expt_name))
 
   print("Loading & splitting data...")
-  raw_data = pd.read_csv(data_csv_path, index_col=0)
+  raw_data = expt_settings.configs.load_data(
+      data_csv_path, columns=data_formatter.get_data_columns())
   train, valid, test = data_formatter.split_data(raw_data)
   train_samples, valid_samples = data_formatter.get_num_samples_for_calibration(
   )
@@ -101,6 +104,15 @@ def main(expt_name,
     params["hidden_layer_size"] = 5
     train_samples, valid_samples = 100, 10
 
+  if cache_folder is not None:
+    libs.tft_model.TFTDataCache.enable_disk_cache(
+        cache_folder,
+        data_csv_path,
+        fixed_params["column_definition"],
+        fixed_params["total_time_steps"],
+        fixed_params["num_encoder_steps"],
+        num_samples=(train_samples, valid_samples))
+
   # Sets up hyperparam manager
   print("*** Loading hyperparm manager ***")
   opt_manager = HyperparamOptManager({k: [params[k]] for k in params},
@@ -235,4 +247,5 @@ if __name__ == "__main__":
       model_folder=os.path.join(config.model_folder, "fixed"),
       data_csv_path=config.data_csv_path,
       data_formatter=formatter,
-      use_testing_mode=True)  # Change to false to use original default params
+      use_testing_mode=True,  # Change to false to use original default params
+      cache_folder=config.cache_folder)